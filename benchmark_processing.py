@@ -0,0 +1,1004 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from microscope_processor import MicroscopeProcessor, PROJECTIONS, __version__
+from sliding_projector import SlidingWindowProjector
+
+# Benchmark sizes: (C, H, W) stacks and (H, W) images, with the dtypes of each
+SUITES = {
+    "quick": {
+        "stacks": [(10, 256, 256), (10, 1024, 1024)],
+        "images": [(256, 256), (1023, 777)],
+        "stack_dtypes": ("uint16", "float32"),
+        "image_dtypes": ("uint8", "float64"),
+    },
+    "full": {
+        "stacks": [(10, 512, 512), (10, 2048, 2048), (40, 1024, 1024)],
+        "images": [(512, 512), (2048, 2048), (2047, 1531), (4096, 4096)],
+        "stack_dtypes": ("uint8", "uint16", "float32", "float64"),
+        "image_dtypes": ("uint8", "float64"),
+    },
+}
+
+# Maximum relative error against the reference implementations
+TOLERANCES = {"exact": 0.0, "fft": 1e-9}
+
+# Modules the compute core must not import (plotting, file readers, unused SciPy, GUI): they are loaded on demand
+HEAVY_MODULES = ("matplotlib", "scipy", "tifffile", "imageio", "PyQt5", "pyqtgraph")
+
+# Run in a fresh interpreter: times the import and lists the heavy modules it loaded
+STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - t0
+print(json.dumps({{"seconds": seconds, "loaded": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+# ------------ Reference implementations
+# The original implementations of the kernels, kept verbatim as the correctness references of the suite
+
+# Implementation of the weighted complex average before the low-memory mode, kept as the benchmark reference
+def reference_weighted_complex_average(stack):
+    C = stack.shape[0]
+    w_k = np.exp(1j * np.arange(C) * 2 * np.pi / C)
+    return np.abs(np.sum(stack * w_k[:, None, None], axis = 0))
+
+
+def reference_average_projection(stack):
+    return np.sum(stack, axis = 0)
+
+
+def reference_max_min_projection(stack):
+    return np.max(stack, axis=0) - np.min(stack, axis=0)
+
+
+def reference_butter_filter_lowpass(cuttoff_frequency, rows, cols, order):
+    freqs_norm = np.linspace(-0.5, 0.5, rows, endpoint=False)
+    Hy = 1.0 / (1.0 + (np.abs(freqs_norm) / cuttoff_frequency)**(2 * order))
+    return Hy[:, np.newaxis] @ np.ones((1, cols))
+
+
+def reference_apply_filter(image_input, H):
+    F_shifted = np.fft.fftshift(np.fft.fft2(image_input))
+    F_filtered = F_shifted * H
+    return np.real(np.fft.ifft2(np.fft.ifftshift(F_filtered))), F_filtered
+
+
+def reference_fourier_based_demodulation(img, T, order):
+    rows, cols = img.shape
+    cut_off_frequency = 1 / T
+    H_high_filter = 1 - reference_butter_filter_lowpass(cut_off_frequency, rows, cols, order)
+    high_filtered_img, _ = reference_apply_filter(img, H_high_filter)
+    x = np.arange(rows)
+    A_mix_img = high_filtered_img * np.cos(2*np.pi*x / T)[:, None]
+    B_mix_img = high_filtered_img * np.sin(2*np.pi*x / T)[:, None]
+    H_low_filter = reference_butter_filter_lowpass(cut_off_frequency, rows, cols, order)
+    A_low_filtered_img, _ = reference_apply_filter(A_mix_img, H_low_filter)
+    B_low_filtered_img, _ = reference_apply_filter(B_mix_img, H_low_filter)
+    img_result = np.sqrt(A_low_filtered_img**2 + B_low_filtered_img**2)
+    return high_filtered_img, A_mix_img, B_mix_img, A_low_filtered_img, B_low_filtered_img, img_result
+
+
+# Synthetic (C, H, W) stack with a sinusoidal modulation along C, as produced by the microscope
+def synthetic_stack(C, H, W, dtype=np.uint16, seed=0):
+    rng = np.random.default_rng(seed)
+    phase = 2 * np.pi * np.arange(C)[:, None, None] / C
+    stack = 1000 + 500 * np.cos(phase + rng.random((1, H, W)) * 2 * np.pi) + 50 * rng.random((C, H, W))
+    return stack.astype(dtype)
+
+
+# Max relative error of result against reference (0 for identical arrays)
+def relative_error(result, reference):
+    scale = np.max(np.abs(reference))
+    error = np.max(np.abs(np.asarray(result, dtype=np.float64) - np.asarray(reference, dtype=np.float64)))
+    return float(error / scale) if scale else float(error)
+
+
+# Runs func `repeat` times, returns (best wall time in seconds, peak traced memory in bytes, result)
+def measure(func, repeat=3):
+    best = float("inf")
+    peak = 0
+    result = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def benchmark_weighted_complex_average(C, H, W, dtype, repeat):
+    stack = synthetic_stack(C, H, W, dtype)
+    processor = MicroscopeProcessor()
+    processor.add_stack_img(stack)
+
+    variants = [
+        ("reference", lambda: reference_weighted_complex_average(stack)),
+        ("complex128", lambda: processor.weighted_complex_average()),
+        ("complex64", lambda: processor.weighted_complex_average(precision="float32")),
+        ("low_memory float64", lambda: processor.weighted_complex_average(low_memory=True)),
+        ("low_memory float32", lambda: processor.weighted_complex_average(low_memory=True, precision="float32")),
+    ]
+
+    print(f"Weighted complex average, stack {C}x{H}x{W} {np.dtype(dtype).name} ({stack.nbytes / 1024**2:.1f} MiB)")
+    print(f"{'variant':<20}{'time [s]':>10}{'Mvox/s':>10}{'peak [MiB]':>12}{'max rel err':>14}")
+    reference = None
+    for name, func in variants:
+        seconds, peak, result = measure(func, repeat)
+        if reference is None:
+            reference = result
+        rel_err = np.max(np.abs(result - reference)) / np.max(np.abs(reference))
+        print(f"{name:<20}{seconds:>10.4f}{stack.size / seconds / 1e6:>10.1f}{peak / 1024**2:>12.1f}{rel_err:>14.2e}")
+
+
+# Synthetic (H, W) image with a fringe pattern of period T along the rows, modulated by a slow envelope
+def synthetic_modulated_image(H, W, T=16, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.arange(H)[:, None]
+    y = np.arange(W)[None, :]
+    envelope = 1 + 0.5 * np.sin(2 * np.pi * x / (37 * T)) * np.cos(2 * np.pi * y / 301)
+    return 100 + 50 * envelope * np.cos(2 * np.pi * x / T) + 10 * rng.random((H, W))
+
+
+# ------------ Benchmark suite
+
+# Stack kernels: name -> (function of the processor, function of the reference outputs, tolerance)
+def stack_kernels():
+    return {
+        "average_projection": (
+            lambda p: p.average_projection(), lambda ref: ref["average"], "exact"),
+        "max_min_projection": (
+            lambda p: p.max_min_projection(), lambda ref: ref["max_min"], "exact"),
+        "weighted_complex_average": (
+            lambda p: p.weighted_complex_average(), lambda ref: ref["weighted_complex"], "fft"),
+        "weighted_complex_average low_memory": (
+            lambda p: p.weighted_complex_average(low_memory=True), lambda ref: ref["weighted_complex"], "fft"),
+        "compute_projections": (
+            lambda p: p.compute_projections(),
+            lambda ref: (ref["average"], ref["max_min"], ref["weighted_complex"]), "fft"),
+    }
+
+
+# Image kernels: name -> (function of the processor, function of the reference outputs, tolerance)
+# The processor is given the image again before each run, so the cached image spectrum is never reused
+def image_kernels(T, order):
+    def demodulate(p, **kwargs):
+        p.add_single_img(p.img)
+        return p.fourier_based_demodulation(T, order, **kwargs)[-1]
+
+    def baseband(p):
+        p.add_single_img(p.img)
+        return p.baseband_demodulation(T, order).magnitude
+
+    def apply_filter(p):
+        H = MicroscopeProcessor._butter_filter_centered("lowpass", 1 / T, p.img.shape[0], order)
+        return MicroscopeProcessor.apply_filter(p.img, H)[0]
+
+    def apply_row_filter(p):
+        H = MicroscopeProcessor._butter_filter_rfft("lowpass", 1 / T, p.img.shape[0], order)
+        return MicroscopeProcessor.apply_row_filter(p.img, H)
+
+    return {
+        "fourier_based_demodulation": (demodulate, lambda ref: ref["demodulation"], "fft"),
+        "fourier_based_demodulation 2-D": (
+            lambda p: demodulate(p, separable=False), lambda ref: ref["demodulation"], "fft"),
+        "baseband_demodulation": (baseband, lambda ref: ref["demodulation"], "fft"),
+        "apply_filter": (apply_filter, lambda ref: ref["low_pass"], "fft"),
+        "apply_row_filter": (apply_row_filter, lambda ref: ref["low_pass"], "fft"),
+    }
+
+
+# Times one kernel and checks it against the reference outputs, returns a result record
+def run_kernel(kernel, case, func, expected, tolerance, voxels, repeat):
+    seconds, peak, result = measure(func, repeat)
+    if isinstance(expected, tuple):
+        error = max(relative_error(r, e) for r, e in zip(result, expected))
+    else:
+        error = relative_error(result, expected)
+    return {
+        "kernel": kernel,
+        "case": case,
+        "seconds": seconds,
+        "voxels_per_s": voxels / seconds,
+        "peak_mib": peak / 1024**2,
+        "max_rel_err": error,
+        "ok": error <= TOLERANCES[tolerance],
+    }
+
+
+# Import time of `module` in a fresh interpreter (best of `repeat`), returns a result record of the suite
+# ("ok" unless the import loaded any of HEAVY_MODULES)
+def measure_startup(module="microscope_processor", repeat=3):
+    script = STARTUP_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout))
+    seconds = min(run["seconds"] for run in runs)
+    loaded = runs[-1]["loaded"]
+    return {
+        "kernel": f"import {module}",
+        "case": "startup",
+        "seconds": seconds,
+        "voxels_per_s": 0.0,
+        "peak_mib": 0.0,
+        "max_rel_err": 0.0,
+        "ok": not loaded,
+        "heavy_modules": loaded,
+    }
+
+
+# Runs every kernel on synthetic stacks and images of the given sizes and dtypes, returns the result records
+def run_suite(stacks, images, stack_dtypes, image_dtypes, repeat=3, T=16, order=3):
+    results = []
+    for C, H, W in stacks:
+        for dtype in stack_dtypes:
+            stack = synthetic_stack(C, H, W, np.dtype(dtype))
+            reference = {
+                "average": reference_average_projection(stack),
+                "max_min": reference_max_min_projection(stack),
+                "weighted_complex": reference_weighted_complex_average(stack),
+            }
+            processor = MicroscopeProcessor()
+            processor.add_stack_img(stack)
+            case = f"{C}x{H}x{W} {dtype}"
+            for kernel, (func, expected, tolerance) in stack_kernels().items():
+                results.append(run_kernel(
+                    kernel, case, lambda: func(processor), expected(reference), tolerance, stack.size, repeat
+                ))
+                print_result(results[-1])
+
+    for H, W in images:
+        for dtype in image_dtypes:
+            img = synthetic_modulated_image(H, W, T)
+            img = np.clip(img, 0, 255).astype(dtype) if np.dtype(dtype).kind == "u" else img.astype(dtype)
+            H_low = reference_butter_filter_lowpass(1 / T, H, W, order)
+            reference = {
+                "demodulation": reference_fourier_based_demodulation(img, T, order)[-1],
+                "low_pass": reference_apply_filter(img, H_low)[0],
+            }
+            processor = MicroscopeProcessor()
+            processor.add_single_img(img)
+            case = f"{H}x{W} {dtype}"
+            for kernel, (func, expected, tolerance) in image_kernels(T, order).items():
+                results.append(run_kernel(
+                    kernel, case, lambda: func(processor), expected(reference), tolerance, img.size, repeat
+                ))
+                print_result(results[-1])
+    return results
+
+
+def print_header():
+    print(f"{'kernel':<38}{'case':<22}{'time [s]':>10}{'Mvox/s':>10}{'peak [MiB]':>12}{'max rel err':>13}")
+
+
+def print_result(result):
+    status = "" if result["ok"] else "  FAILED"
+    if result.get("heavy_modules"):
+        status += f" (imports {', '.join(result['heavy_modules'])})"
+    print(f"{result['kernel']:<38}{result['case']:<22}{result['seconds']:>10.4f}{result['voxels_per_s'] / 1e6:>10.1f}"
+          f"{result['peak_mib']:>12.1f}{result['max_rel_err']:>13.2e}{status}")
+
+
+def environment():
+    return {
+        "version": __version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "fft_backend": repr(MicroscopeProcessor.fft_backend),
+    }
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+
+# Compares the results with a saved baseline. A kernel is a regression when it is more than `threshold` times
+# slower than its baseline. Returns the number of regressions
+def compare_baseline(path, results, threshold=1.2):
+    with open(path) as f:
+        baseline = json.load(f)
+    previous = {(r["kernel"], r["case"]): r for r in baseline["results"]}
+    print(f"\nComparison with {path} (version {baseline['environment'].get('version')})")
+    print(f"{'kernel':<38}{'case':<22}{'baseline [s]':>13}{'time [s]':>10}{'speedup':>9}")
+    regressions = 0
+    for result in results:
+        before = previous.get((result["kernel"], result["case"]))
+        if before is None:
+            continue
+        speedup = before["seconds"] / result["seconds"]
+        regression = speedup < 1 / threshold
+        regressions += regression
+        flag = "  REGRESSION" if regression else ""
+        print(f"{result['kernel']:<38}{result['case']:<22}{before['seconds']:>13.4f}{result['seconds']:>10.4f}"
+              f"{speedup:>8.2f}x{flag}")
+    return regressions
+
+
+# The compute core imports without plotting, file readers or SciPy
+def check_headless_import(module="microscope_processor"):
+    result = measure_startup(module, repeat=1)
+    status = "OK" if result["ok"] else "FAILED"
+    print(f"Headless import of {module}: {result['seconds']:.3f} s, "
+          f"heavy modules loaded: {', '.join(result['heavy_modules']) or 'none'} [{status}]")
+    return result["ok"]
+
+
+# Accuracy of the tiled (overlap-save) demodulation against the full-frame baseband demodulation
+def check_tiled_demodulation(H, W, T, order, tile_rows, tile_cols, tolerance=1e-6):
+    processor = MicroscopeProcessor()
+    processor.add_single_img(synthetic_modulated_image(H, W, T))
+    full = processor.baseband_demodulation(T, order).magnitude
+    tiled = processor.tiled_demodulation(T, order, tile_rows=tile_rows, tile_cols=tile_cols).magnitude
+    rel_err = np.max(np.abs(tiled - full)) / np.max(full)
+    status = "OK" if rel_err <= tolerance else "FAILED"
+    print(f"Tiled demodulation {H}x{W}, T={T}, order={order}, tiles {tile_rows}x{tile_cols}: "
+          f"max rel err {rel_err:.2e} [{status}]")
+    return rel_err <= tolerance
+
+
+# Parameter sweep (one shared image spectrum) against separate fourier_based_demodulation calls for every pair
+def check_demodulation_sweep(H, W, periods, orders, tolerance=1e-9):
+    processor = MicroscopeProcessor()
+    processor.add_single_img(synthetic_modulated_image(H, W, periods[0]))
+    t0 = time.perf_counter()
+    sweep = processor.demodulation_sweep(periods, orders).magnitude
+    sweep_seconds = time.perf_counter() - t0
+    max_err = 0.0
+    t0 = time.perf_counter()
+    for i, T in enumerate(periods):
+        for j, order in enumerate(orders):
+            processor.add_single_img(processor.img)
+            expected = processor.fourier_based_demodulation(T, order)[-1]
+            max_err = max(max_err, np.max(np.abs(sweep[i, j] - expected)) / np.max(expected))
+    calls_seconds = time.perf_counter() - t0
+    status = "OK" if max_err <= tolerance else "FAILED"
+    print(f"Demodulation sweep {H}x{W}, {len(periods)} periods x {len(orders)} orders: max rel err {max_err:.2e}, "
+          f"{sweep_seconds:.3f} s vs {calls_seconds:.3f} s for separate calls [{status}]")
+    return max_err <= tolerance
+
+
+# Batched stack demodulation against per-frame demodulations: chunks that do not divide the frame count, with the
+# intermediates. Every field must match baseband_demodulation, the magnitude also fourier_based_demodulation
+def check_stack_demodulation(N, H, W, T, order, chunk_frames, tolerance=1e-9):
+    images = np.stack([synthetic_modulated_image(H, W, T, seed=n) for n in range(N)])
+    processor = MicroscopeProcessor()
+    result = processor.demodulate_stack(T, order, images, chunk_frames=chunk_frames, intermediates=True)
+    max_err = 0.0
+    for n in range(N):
+        processor.add_single_img(images[n])
+        frame = processor.baseband_demodulation(T, order, intermediates=True)
+        for name, expected in frame._asdict().items():
+            if expected is not None:
+                max_err = max(max_err, relative_error(getattr(result, name)[n], expected))
+        max_err = max(max_err, relative_error(result.magnitude[n], processor.fourier_based_demodulation(T, order)[-1]))
+    status = "OK" if max_err <= tolerance else "FAILED"
+    print(f"Stack demodulation {N}x{H}x{W}, T={T}, order {order}, chunks of {chunk_frames} frames, intermediates: "
+          f"max rel err {max_err:.2e} [{status}]")
+    return max_err <= tolerance
+
+
+# Cached image spectrum: after a demodulation, assigning another image to processor.img must not reuse the spectrum
+# of the previous one (standard, baseband and sweep results against a fresh processor)
+def check_image_reassignment(H, W, T, order, tolerance=1e-12):
+    first = synthetic_modulated_image(H, W, T, seed=0)
+    second = synthetic_modulated_image(H, W, T, seed=1)
+    processor = MicroscopeProcessor()
+    processor.add_single_img(first)
+    processor.fourier_based_demodulation(T, order)
+    processor.img = second
+    fresh = MicroscopeProcessor()
+    fresh.add_single_img(second)
+    max_err = max(
+        relative_error(processor.fourier_based_demodulation(T, order)[-1],
+                       fresh.fourier_based_demodulation(T, order)[-1]),
+        relative_error(processor.baseband_demodulation(T, order).magnitude,
+                       fresh.baseband_demodulation(T, order).magnitude),
+        relative_error(processor.demodulation_sweep((T,), (order,)).magnitude,
+                       fresh.demodulation_sweep((T,), (order,)).magnitude),
+    )
+    status = "OK" if max_err <= tolerance else "FAILED"
+    print(f"Image reassignment {H}x{W}, T={T}, order {order}: max rel err {max_err:.2e} against a fresh processor "
+          f"[{status}]")
+    return max_err <= tolerance
+
+
+# Channel subset and ROI loading (uncompressed, striped and tiled compressed TIFFs, in memory and lazily opened)
+# against slicing the fully loaded stack. The uncompressed selection must stay a view of the file
+def check_roi_loading(C, H, W, channels, roi):
+    import tempfile
+    import tifffile
+
+    stack = synthetic_stack(C, H, W)
+    # A single frame index selects a one-frame stack
+    expected = stack[np.atleast_1d(np.arange(C)[channels])][:, roi[0]:roi[1], roi[2]:roi[3]]
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        layouts = {"raw": {}, "zlib strips": {"compression": "zlib", "rowsperstrip": 16},
+                   "zlib tiles": {"compression": "zlib", "tile": (32, 32)}}
+        for layout, kwargs in layouts.items():
+            path = os.path.join(folder, layout.replace(" ", "_") + ".tif")
+            tifffile.imwrite(path, stack, **kwargs)
+            for mmap in (False, True):
+                loaded = MicroscopeProcessor.load_tif(path, mmap=mmap, channels=channels, roi=roi)
+                equal = np.array_equal(np.asarray(loaded[:]), expected)
+                view = not (mmap and layout == "raw") or isinstance(loaded, np.memmap)
+                if hasattr(loaded, "close"):
+                    loaded.close()
+                ok = ok and equal and view
+                status = "OK" if equal and view else "FAILED"
+                print(f"ROI loading {C}x{H}x{W} {layout}, mmap={mmap}, channels {channels}, roi {roi}: "
+                      f"{type(loaded).__name__} {loaded.shape} [{status}]")
+    return ok
+
+
+# ROI of gray and RGB PNG images (load_png and add_single_img): the ROI crops the first two axes only
+def check_image_roi_loading(H, W, roi):
+    import tempfile
+    import imageio.v2 as iio
+
+    rng = np.random.default_rng(0)
+    images = {"gray": rng.integers(0, 256, (H, W), dtype=np.uint8),
+              "RGB": rng.integers(0, 256, (H, W, 3), dtype=np.uint8)}
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        for name, image in images.items():
+            expected = image[roi[0]:roi[1], roi[2]:roi[3]]
+            path = os.path.join(folder, name + ".png")
+            iio.imwrite(path, image)
+            loaded = MicroscopeProcessor.load_png(path, roi=roi)
+            processor = MicroscopeProcessor()
+            processor.add_single_img(image, roi=roi)
+            equal = np.array_equal(loaded, expected) and np.array_equal(processor.img, expected)
+            ok = ok and equal
+            print(f"Image ROI loading {name} {image.shape}, roi {roi}: {loaded.shape} [{'OK' if equal else 'FAILED'}]")
+    return ok
+
+
+# Harmonic projection (magnitude and phase, through the complex coefficient they encode) against the direct DFT
+# Σ_k I_k exp(i·h·k·2π/C), for the DC term, mirrored (h > C/2) and negative harmonics, on an in-memory stack and
+# on a zlib TIFF read page by page (TifPageStack)
+def check_harmonic_projection(C, H, W, harmonics, tolerance=1e-12):
+    import tempfile
+    import tifffile
+
+    stack = synthetic_stack(C, H, W)
+    k = np.arange(C).reshape(-1, 1, 1)
+    expected = np.stack([np.sum(stack * np.exp(1j * h * k * 2 * np.pi / C), axis=0) for h in harmonics])
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "stack.tif")
+        tifffile.imwrite(path, stack, compression="zlib")
+        pages = MicroscopeProcessor.load_tif(path, mmap=True)
+        for images in (stack, pages):
+            processor = MicroscopeProcessor()
+            processor.add_stack_img(images)
+            result = processor.harmonic_projection(harmonics)
+            # Per harmonic, so the DC term does not hide errors of the weaker harmonics
+            coefficients = result.magnitude * np.exp(1j * result.phase)
+            error = max(np.max(np.abs(coefficients[i] - expected[i])) / np.max(np.abs(expected[i]))
+                        for i in range(len(harmonics)))
+            passed = result.harmonics == tuple(harmonics) and error <= tolerance
+            ok = ok and passed
+            print(f"Harmonic projection {C}x{H}x{W} {type(images).__name__}, harmonics {tuple(harmonics)}: "
+                  f"max rel err {error:.2e} [{'OK' if passed else 'FAILED'}]")
+        pages.close()
+    return ok
+
+
+# Largest relative error of the projections of a ProjectionResult against an expected one
+def projection_error(result, expected):
+    return max(relative_error(getattr(result, name), getattr(expected, name)) for name in PROJECTIONS)
+
+
+# Streaming projections against the in-memory ones: a memory budget on an in-memory stack, memmaps of raw TIFFs
+# and TifPageStacks of zlib TIFFs, with the default budget and one smaller than a frame (one row band, one frame
+# at a time). Average and max-min must be exact, the page-by-page weighted complex average agrees to rounding
+def check_streaming_projections(C, H, W, tolerance=1e-12):
+    import tempfile
+    import tifffile
+
+    stack = synthetic_stack(C, H, W)
+    reference = MicroscopeProcessor()
+    reference.add_stack_img(stack)
+    expected = reference.compute_projections()
+    tiny_budget = H * W * stack.itemsize // 4
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        for compression in (None, "zlib"):
+            path = os.path.join(folder, f"{compression or 'raw'}.tif")
+            tifffile.imwrite(path, stack, compression=compression)
+            for budget in (None, tiny_budget):
+                cases = {f"{compression or 'raw'} in memory": MicroscopeProcessor.load_tif(path)}
+                cases[f"{compression or 'raw'} mmap"] = MicroscopeProcessor.load_tif(path, mmap=True)
+                for name, images in cases.items():
+                    if budget is None and isinstance(images, np.ndarray) and not isinstance(images, np.memmap):
+                        continue
+                    processor = MicroscopeProcessor(memory_budget=budget)
+                    processor.add_stack_img(images)
+                    result = processor.compute_projections()
+                    exact = all(np.array_equal(getattr(result, projection), getattr(expected, projection))
+                                for projection in ("average", "max_min"))
+                    error = relative_error(result.weighted_complex, expected.weighted_complex)
+                    passed = exact and error <= tolerance
+                    ok = ok and passed
+                    budget_text = "default budget" if budget is None else f"budget {budget} B"
+                    print(f"Streaming projections {C}x{H}x{W} {name} ({type(images).__name__}), {budget_text}: "
+                          f"average/max-min {'exact' if exact else 'DIFFER'}, weighted complex rel err {error:.2e} "
+                          f"[{'OK' if passed else 'FAILED'}]")
+                    if hasattr(images, "close"):
+                        images.close()
+                del cases, images
+    return ok
+
+
+# Row-tile scheduler (workers > 1, thread and process executors) against the serial in-memory projections, on
+# in-memory stacks, memmaps and memmap views (a channel subset attached through its file offset, a ROI through a
+# shared-memory copy). band_rows is kept small so every worker reduces several bands
+def check_parallel_projections(C, H, W, workers, band_rows=16, tolerance=1e-12):
+    import tempfile
+    import tifffile
+
+    stack = synthetic_stack(C, H, W)
+    budget = band_rows * C * W * (stack.itemsize + 24)
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "stack.tif")
+        tifffile.imwrite(path, stack)
+        mapped = tifffile.memmap(path, mode="r")
+        inputs = {
+            "in-memory": stack,
+            "memmap": mapped,
+            "memmap channels": mapped[2:C - 1],
+            "memmap ROI": mapped[:, H // 5:H - 3, W // 4:W - 1],
+        }
+        for name, images in inputs.items():
+            serial = MicroscopeProcessor()
+            serial.add_stack_img(np.array(images))
+            expected = serial.compute_projections()
+            for executor in ("thread", "process"):
+                processor = MicroscopeProcessor(memory_budget=budget, workers=workers, executor=executor)
+                processor.add_stack_img(images)
+                error = projection_error(processor.compute_projections(), expected)
+                ok = ok and error <= tolerance
+                status = "OK" if error <= tolerance else "FAILED"
+                print(f"Parallel projections {name} {images.shape}, {workers} {executor} workers: "
+                      f"max rel err {error:.2e} [{status}]")
+        del mapped, inputs
+    return ok
+
+
+# FilterBank: a max_bytes bank evicts the least recently used filter (a hit refreshes it), keeps the newest one
+# even when it alone exceeds the limit, and counts hits, misses and evictions (filters built on misses only)
+def check_filter_bank(n=1000):
+    from filter_bank import FilterBank
+
+    built = []
+
+    def build(value, size=n):
+        built.append(value)
+        return np.full(size, float(value))
+
+    bank = FilterBank(max_bytes=int(2.5 * n * 8))
+    for cutoff in (1, 2, 1, 3, 2):
+        bank.get("low", cutoff, (n,), 3, lambda: build(cutoff))
+    cached = {cutoff: bank.get("low", cutoff, (n,), 3, lambda: build(-1))[0] for cutoff in (3, 2)}
+    stats = bank.stats()
+    lru = (built == [1, 2, 3, 2] and cached == {3: 3.0, 2: 2.0} and stats.hits == 3 and stats.misses == 4
+           and stats.evictions == 2 and stats.entries == 2 and stats.nbytes <= stats.max_bytes)
+    bank.get("low", 4, (4 * n,), 3, lambda: build(4, 4 * n))
+    stats = bank.stats()
+    newest = stats.entries == 1 and bank.get("low", 4, (4 * n,), 3, lambda: build(-1))[0] == 4.0
+    ok = lru and newest
+    print(f"Filter bank LRU: {stats.hits} hits, {stats.misses} misses, {stats.evictions} evictions, oversized "
+          f"newest filter kept [{'OK' if ok else 'FAILED'}]")
+    return ok
+
+
+# ResultCache: keys shared by the CLI and GUI parameters (float/int period, list/tuple ROI, absolute/relative path),
+# file hashes reported, cancellable and reused by another cache on the folder, LRU eviction (a read refreshes an
+# entry or a file hash, stale file hashes are evicted too) and atomic replace (a failed write leaves the previous entry intact and no temporary file)
+def check_result_cache(size=256 * 1024):
+    import tempfile
+    from result_cache import ResultCache, demodulation_params, projection_params
+
+    class Cancelled(Exception):
+        pass
+
+    def cancel(done, total):
+        raise Cancelled()
+
+    def status(ok):
+        return "OK" if ok else "FAILED"
+
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        source = os.path.join(folder, "input.bin")
+        with open(source, "wb") as f:
+            f.write(np.random.default_rng(0).bytes(size))
+        cache = ResultCache(os.path.join(folder, "cache"))
+
+        roi = [3, 40, 5, 60]
+        cli_key = cache.key(source, "weighted_complex", projection_params("weighted_complex", False, "float64", roi=roi))
+        gui_key = cache.key(os.path.relpath(source), "weighted_complex",
+                            projection_params("weighted_complex", roi=tuple(roi)))
+        cli_demodulation = cache.key(source, "fourier_based_demodulation", demodulation_params(16.0, 8, roi=roi))
+        gui_demodulation = cache.key(source, "fourier_based_demodulation", demodulation_params(16, 8, roi=tuple(roi)))
+        other = cache.key(source, "fourier_based_demodulation", demodulation_params(16.5, 8, roi=roi))
+        stable = cli_key == gui_key and cli_demodulation == gui_demodulation and other != cli_demodulation
+        ok = ok and stable
+        print(f"Result cache keys: CLI and GUI parameters share entries [{status(stable)}]")
+
+        # A modified file is hashed again (explicit mtime: coarse file system clocks may not tick between writes)
+        with open(source, "r+b") as f:
+            f.write(b"changed")
+        os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 10**9))
+        reports = []
+        fresh = ResultCache(cache.directory)
+        try:
+            fresh.content_hash(source, cancel)
+            cancelled = False
+        except Cancelled:
+            cancelled = True
+        fresh.content_hash(source, lambda done, total: reports.append((done, total)))
+        reused = []
+        ResultCache(cache.directory).content_hash(source, lambda done, total: reused.append(done))
+        hashing = cancelled and bool(reports) and reports[-1][0] == reports[-1][1] and not reused
+        ok = ok and hashing
+        print(f"Result cache hashing: {len(reports)} progress reports, cancellable, reused by another cache "
+              f"[{status(hashing)}]")
+
+        entry = {"result": np.zeros(size // 8)}
+        lru = ResultCache(os.path.join(folder, "lru"), max_bytes=int(2.5 * size))
+        keys = [lru.key(source, "average", {"n": n}) for n in range(3)]
+        lru.put(keys[0], entry)
+        lru.put(keys[1], entry)
+        now = time.time()
+        for age, key in ((20, keys[0]), (10, keys[1])):
+            os.utime(lru._path(key), (now - age, now - age))
+        lru.get(keys[0])
+        lru.put(keys[2], entry)
+        kept = [os.path.exists(lru._path(key)) for key in keys]
+        evicted = kept == [True, False, True] and lru.size() <= lru.max_bytes
+        ok = ok and evicted
+        print(f"Result cache LRU eviction: entries kept {kept} [{status(evicted)}]")
+
+        # File hashes count toward max_bytes: the two least recently read of three go first, the entry stays
+        hashed = ResultCache(os.path.join(folder, "hashed"))
+        hash_folder = os.path.join(hashed.directory, "hashes")
+        inputs = []
+        for n in range(3):
+            inputs.append(os.path.join(folder, f"input_{n}.bin"))
+            with open(inputs[-1], "wb") as f:
+                f.write(bytes([n]) * 1024)
+            hashed.content_hash(inputs[-1])
+        for name in os.listdir(hash_folder):
+            os.utime(os.path.join(hash_folder, name), (now - 30, now - 30))
+        ResultCache(hashed.directory).content_hash(inputs[2])
+        hashed.put(keys[0], entry)
+        hash_bytes = sum(os.path.getsize(os.path.join(hash_folder, name)) for name in os.listdir(hash_folder))
+        hashed.max_bytes = hashed.size() - hash_bytes * 2 // 3
+        hashed.put(keys[0], entry)
+        reread = []
+        ResultCache(hashed.directory).content_hash(inputs[2], lambda done, total: reread.append(done))
+        pruned = (len(os.listdir(hash_folder)) == 1 and not reread and hashed.get(keys[0]) is not None
+                  and hashed.size() <= hashed.max_bytes)
+        ok = ok and pruned
+        print(f"Result cache file hashes: counted in the size limit, least recently read evicted "
+              f"[{status(pruned)}]")
+
+        previous = {"result": np.arange(10.0)}
+        cache.put(cli_key, previous)
+        savez = np.savez
+
+        def failing_savez(f, **arrays):
+            f.write(b"partial")
+            raise OSError("disk full")
+
+        np.savez = failing_savez
+        try:
+            cache.put(cli_key, {"result": np.ones(10)})
+            raised = False
+        except OSError:
+            raised = True
+        finally:
+            np.savez = savez
+        intact = cache.get(cli_key)
+        leftovers = [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
+        atomic = raised and intact is not None and np.array_equal(intact["result"], previous["result"]) \
+            and not leftovers
+        ok = ok and atomic
+        print(f"Result cache atomic replace: failed write keeps the previous entry [{status(atomic)}]")
+    return ok
+
+
+# OutputWriter round trips: every format and sample type read back (uint16 through the offset/scale of the TIFF
+# metadata or the OME Description, PNG as an 8-bit gray quick-look; zarr only when installed), and max_pending
+# backpressure: submit() blocks while the slots are taken and failed writes release their slot
+def check_output_writer(H, W):
+    import tempfile
+    import threading
+    import xml.etree.ElementTree as ElementTree
+    import imageio.v2 as iio
+    import tifffile
+    from output_writer import OUTPUT_DTYPES, OUTPUT_FORMATS, OutputWriter
+
+    image = synthetic_modulated_image(H, W) * 3.5 - 1.25
+    formats = [name for name in OUTPUT_FORMATS if name != "zarr"]
+    try:
+        import zarr
+        formats.append("zarr")
+    except ImportError:
+        zarr = None
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        for format in formats:
+            for dtype in OUTPUT_DTYPES if format != "png" else ("native",):
+                compression = "zlib" if format != "png" else None
+                with OutputWriter(format, dtype, compression) as writer:
+                    path, _ = writer.submit(os.path.join(folder, f"{format}_{dtype}"), image).result()
+                if format == "png":
+                    data = iio.imread(path)[..., 0]
+                    expected = np.rint((image - image.min()) / np.ptp(image) * 255)
+                    error = np.max(np.abs(data - expected)) / 255
+                    # The colormap lookup truncates instead of rounding
+                    tolerance, expected_dtype = 2 / 255, np.uint8
+                else:
+                    if format == "zarr":
+                        array = zarr.open_array(store=path, mode="r")
+                        data, metadata = array[...], dict(array.attrs)
+                    else:
+                        with tifffile.TiffFile(path) as tif:
+                            data = tif.asarray()
+                            if format == "ome-tiff":
+                                ome = ElementTree.fromstring(tif.ome_metadata)
+                                description = ome.find(".//{*}Image/{*}Description")
+                                metadata = json.loads(description.text) if description is not None else {}
+                            else:
+                                metadata = tif.shaped_metadata[0]
+                    values = metadata.get("offset", 0.0) + metadata.get("scale", 1.0) * data.astype(np.float64)
+                    error = relative_error(values, image)
+                    tolerance, expected_dtype = {"float32": (1e-6, np.float32), "uint16": (1e-4, np.uint16),
+                                                 "native": (0.0, image.dtype)}[dtype]
+                passed = data.dtype == expected_dtype and data.shape == image.shape and error <= tolerance
+                ok = ok and passed
+                print(f"Output writer {format} {dtype}: {data.dtype} {data.shape}, max rel err {error:.2e} "
+                      f"[{'OK' if passed else 'FAILED'}]")
+
+        # Backpressure: one worker held by a blocked write, max_pending=2 slots
+        release = threading.Event()
+        writer = OutputWriter("tiff", "float32", workers=1, max_pending=2)
+        writer.write = lambda path, image: (release.wait(), path)[1]
+        held = [writer.submit(os.path.join(folder, f"held_{i}"), image) for i in range(2)]
+        blocked = threading.Thread(target=writer.submit, args=(os.path.join(folder, "blocked"), image), daemon=True)
+        blocked.start()
+        blocked.join(0.2)
+        blocks = blocked.is_alive()
+        release.set()
+        blocked.join(5)
+        writer.close()
+        # Failing writes (missing folder) release their slot: more failures than slots must not deadlock
+        writer = OutputWriter("tiff", "float32", workers=1, max_pending=2)
+        failures = []
+        submitter = threading.Thread(target=lambda: failures.extend(
+            writer.submit(os.path.join(folder, "missing", f"img_{i}"), image) for i in range(6)
+        ), daemon=True)
+        submitter.start()
+        submitter.join(5)
+        failed = not submitter.is_alive() and len(failures) == 6 and all(f.exception(5) for f in failures)
+        writer.close()
+        passed = blocks and not blocked.is_alive() and all(f.done() for f in held) and failed
+        ok = ok and passed
+        print(f"Output writer backpressure: max_pending=2 blocks a third submit, failed writes release their slot "
+              f"[{'OK' if passed else 'FAILED'}]")
+    return ok
+
+
+# Processing service round trips on a temporary Unix socket (thread executor): path and shared-memory inputs against
+# MicroscopeProcessor, the 400/500 error mapping, and ServiceBusy (HTTP 503) once workers + queue_size requests
+# are in flight
+def check_processing_service(C, H, W, T=16, order=3, tolerance=1e-12):
+    import tempfile
+    import threading
+    import tifffile
+    from processing_service import ProcessingClient, ProcessingService, ServiceBusy, ServiceError, create_server
+
+    stack = synthetic_stack(C, H, W)
+    image = synthetic_modulated_image(H, W, T)
+    channels, roi = [0, 2, 3], (5, H - 7, 3, W - 2)
+    local = MicroscopeProcessor()
+    local.add_stack_img(stack, channels=channels, roi=roi)
+    projections = local.compute_projections()
+    local.add_single_img(image)
+    demodulation = local.baseband_demodulation(T, order)
+
+    def status(ok):
+        return "OK" if ok else "FAILED"
+
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "stack.tif")
+        tifffile.imwrite(path, stack)
+        address = os.path.join(folder, "service.sock")
+        workers, queue_size = 1, 1
+        with ProcessingService(workers, queue_size, executor="thread") as service:
+            server = create_server(service, address)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                client = ProcessingClient(address, timeout=60)
+                errors = {
+                    "path": projection_error(client.projections(path, channels=channels, roi=roi), projections),
+                    "shared memory": projection_error(client.projections(stack, channels=channels, roi=roi),
+                                                      projections),
+                    "shared memory demodulation": max(
+                        relative_error(getattr(client.demodulation(image, T, order, method="baseband"), name),
+                                       getattr(demodulation, name))
+                        for name in ("magnitude", "phase")
+                    ),
+                }
+                for name, error in errors.items():
+                    ok = ok and error <= tolerance
+                    print(f"Processing service {name} request: max rel err {error:.2e} [{status(error <= tolerance)}]")
+
+                codes = []
+                for operation, source, params in (("demodulation", image, {"T": T, "order": order, "method": "?"}),
+                                                  ("projections", folder, {})):
+                    try:
+                        client.process(operation, source, params)
+                        codes.append(200)
+                    except ServiceError as e:
+                        codes.append(e.status)
+                mapped = codes == [400, 500]
+                ok = ok and mapped
+                print(f"Processing service errors: bad request -> {codes[0]}, unreadable input -> {codes[1]} "
+                      f"[{status(mapped)}]")
+
+                # The only worker is held, so the next requests stay in flight until it is released
+                release = threading.Event()
+                service._pool.submit(release.wait)
+                answers = []
+                pending = [threading.Thread(target=lambda: answers.append(client.projections(stack)))
+                           for _ in range(workers + queue_size)]
+                for request in pending:
+                    request.start()
+                deadline = time.time() + 10
+                while service.metrics.to_dict()["in_flight"] < len(pending) and time.time() < deadline:
+                    time.sleep(0.01)
+                try:
+                    client.projections(stack)
+                    busy = False
+                except ServiceBusy:
+                    busy = True
+                release.set()
+                for request in pending:
+                    request.join(60)
+                served = busy and len(answers) == len(pending)
+                ok = ok and served
+                print(f"Processing service backpressure: {workers} worker + {queue_size} queued in flight, next "
+                      f"request {'rejected (503)' if busy else 'accepted'}, {len(answers)} queued answers "
+                      f"[{status(served)}]")
+            finally:
+                server.shutdown()
+                server.server_close()
+    return ok
+
+
+# Local synthetic acquisition stream: yields n (H, W) frames of a phase-stepped fringe pattern with noise
+def synthetic_frame_source(n, H, W, C=10, dtype=np.uint16, seed=0):
+    rng = np.random.default_rng(seed)
+    base_phase = rng.random((H, W)) * 2 * np.pi
+    for t in range(n):
+        frame = 1000 + 500 * np.cos(base_phase + 2 * np.pi * t / C) + 50 * rng.random((H, W))
+        yield frame.astype(dtype)
+
+
+# Incremental sliding-window projections against MicroscopeProcessor on the same window, after every frame
+def check_sliding_window_projector(n, H, W, C, dtype=np.uint16, tolerance=1e-6):
+    projector = SlidingWindowProjector(C)
+    window = []
+    max_err = 0.0
+    for frame in synthetic_frame_source(n, H, W, C, dtype):
+        projector.push(frame)
+        window = (window + [frame])[-C:]
+        processor = MicroscopeProcessor()
+        processor.add_stack_img(np.stack(window))
+        expected = processor.compute_projections()
+        result = projector.compute_projections()
+        scale = np.max(np.abs(expected.average))
+        for name in ("average", "max_min", "weighted_complex") if len(window) == C else ("average", "max_min"):
+            max_err = max(max_err, np.max(np.abs(getattr(result, name) - getattr(expected, name))) / scale)
+    status = "OK" if max_err <= tolerance else "FAILED"
+    print(f"Sliding window projector {n} frames {H}x{W} {np.dtype(dtype).name}, window {C}: "
+          f"max rel err {max_err:.2e} [{status}]")
+    return max_err <= tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MicroscopeProcessor kernels")
+    parser.add_argument("--suite", choices=tuple(SUITES), default="quick", help="Preset sizes and dtypes")
+    parser.add_argument("--frames", "-C", type=int, default=10)
+    parser.add_argument("--height", "-H", type=int, default=2048)
+    parser.add_argument("--width", "-W", type=int, default=2048)
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--size", action="store_true",
+                        help="Benchmark the single -C/-H/-W/--dtype size instead of the preset suite")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-baseline", metavar="JSON", help="Store the results as a baseline")
+    parser.add_argument("--baseline", metavar="JSON", help="Compare the results with a stored baseline")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown factor against the baseline reported as a regression")
+    parser.add_argument("--variants", action="store_true",
+                        help="Compare the weighted complex average variants (precision, low memory) instead")
+    parser.add_argument("--check", action="store_true", help="Run the accuracy checks instead of the benchmarks")
+    args = parser.parse_args()
+
+    if args.check:
+        results = [
+            check_headless_import(),
+            check_headless_import("processing_service"),
+            check_tiled_demodulation(args.height, args.width // 4, 16, 8, args.height // 5, args.width // 16),
+            check_tiled_demodulation(args.height - 1, args.width // 4 + 1, 16, 3, args.height // 3, args.width),
+            check_tiled_demodulation(args.height + 1, 64, 7.5, 4, args.height // 4, 64),
+            check_sliding_window_projector(4 * args.frames + 3, 64, 48, args.frames, np.uint16),
+            check_sliding_window_projector(4 * args.frames + 3, 64, 48, args.frames, np.float64),
+            check_demodulation_sweep(args.height // 4 + 1, args.width // 8, (12, 16, 22.5), (2, 3, 8)),
+            check_stack_demodulation(7, args.height // 4 + 1, args.width // 8, 16, 3, chunk_frames=3),
+            check_image_reassignment(args.height // 4 + 1, args.width // 8, 16, 3),
+            check_roi_loading(args.frames, 150, 130, slice(1, None, 3), (17, 101, 40, 97)),
+            check_roi_loading(args.frames, 150, 130, 3, (0, 150, 7, 130)),
+            check_image_roi_loading(64, 48, (0, 10, 0, 20)),
+            check_harmonic_projection(args.frames, 150, 130, (0, 1, args.frames // 2 + 1, -1)),
+            check_parallel_projections(args.frames, 150, 130, workers=3),
+            check_streaming_projections(args.frames, 150, 130),
+            check_filter_bank(),
+            check_result_cache(),
+            check_output_writer(96, 80),
+            check_processing_service(args.frames, 96, 80),
+        ]
+        raise SystemExit(0 if all(results) else 1)
+
+    if args.variants:
+        benchmark_weighted_complex_average(args.frames, args.height, args.width, np.dtype(args.dtype), args.repeat)
+        return
+
+    if args.size:
+        suite = {
+            "stacks": [(args.frames, args.height, args.width)],
+            "images": [(args.height, args.width)],
+            "stack_dtypes": (args.dtype,),
+            "image_dtypes": ("float64",),
+        }
+    else:
+        suite = SUITES[args.suite]
+    print_header()
+    results = [measure_startup(repeat=args.repeat)]
+    print_result(results[-1])
+    results += run_suite(suite["stacks"], suite["images"], suite["stack_dtypes"], suite["image_dtypes"], args.repeat)
+    failures = sum(not result["ok"] for result in results)
+    print(f"{len(results)} kernels, {failures} correctness failures")
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    regressions = compare_baseline(args.baseline, results, args.threshold) if args.baseline else 0
+    raise SystemExit(1 if failures or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import numpy as np
+
+# Selectable FFT implementations
+FFT_BACKENDS = ("numpy", "scipy", "pyfftw")
+
+
+class FFTBackend:
+    """FFT layer used by every Fourier routine of MicroscopeProcessor.
+
+    name: "numpy" (single-threaded np.fft), "scipy" (scipy.fft, multi-threaded with workers=N)
+    or "pyfftw" (pyFFTW's scipy.fft interface, multi-threaded, only when pyFFTW is installed).
+    workers: number of threads for scipy/pyfftw (None = library default, -1 = all cores).
+
+    Plans are reused for repeated shapes: numpy and scipy keep an internal plan cache in pocketfft,
+    and the pyFFTW interface cache is enabled so FFTW plans survive between calls.
+
+    Listeners (see add_listener) are called with the transform name ("fft", "rfft", ...) before every transform,
+    e.g. to count FFT calls in ProcessingMetrics.
+    """
+
+    def __init__(self, name="numpy", workers=None, keepalive_time=60.0):
+        if name not in FFT_BACKENDS:
+            raise ValueError(f"Unknown FFT backend {name!r}, expected any of {FFT_BACKENDS}")
+        self.name = name
+        self.workers = workers
+        self._kwargs = {}
+        self._listeners = ()
+
+        if name == "numpy":
+            self._module = np.fft
+        elif name == "scipy":
+            import scipy.fft
+            self._module = scipy.fft
+        else:
+            try:
+                import pyfftw
+                import pyfftw.interfaces.scipy_fft
+            except ImportError as e:
+                raise ImportError("The 'pyfftw' FFT backend requires pyFFTW to be installed") from e
+            pyfftw.interfaces.cache.enable()
+            pyfftw.interfaces.cache.set_keepalive_time(keepalive_time)
+            self._module = pyfftw.interfaces.scipy_fft
+
+        if name != "numpy" and workers is not None:
+            self._kwargs["workers"] = workers
+
+    def __repr__(self):
+        return f"FFTBackend(name={self.name!r}, workers={self.workers!r})"
+
+    # Backends that can be selected in this environment
+    @staticmethod
+    def available():
+        backends = ["numpy"]
+        for name, module in (("scipy", "scipy.fft"), ("pyfftw", "pyfftw")):
+            try:
+                __import__(module)
+            except ImportError:
+                continue
+            backends.append(name)
+        return tuple(backends)
+
+    # The listener tuple is replaced, never mutated, so transforms running on other threads can iterate it safely
+    def add_listener(self, listener):
+        self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        listeners = list(self._listeners)
+        if listener in listeners:
+            listeners.remove(listener)
+        self._listeners = tuple(listeners)
+
+    def _notify(self, kind):
+        for listener in self._listeners:
+            listener(kind)
+
+    def fft(self, a, n=None, axis=-1):
+        self._notify("fft")
+        return self._module.fft(a, n=n, axis=axis, **self._kwargs)
+
+    def ifft(self, a, n=None, axis=-1):
+        self._notify("ifft")
+        return self._module.ifft(a, n=n, axis=axis, **self._kwargs)
+
+    def rfft(self, a, n=None, axis=-1):
+        self._notify("rfft")
+        return self._module.rfft(a, n=n, axis=axis, **self._kwargs)
+
+    def irfft(self, a, n=None, axis=-1):
+        self._notify("irfft")
+        return self._module.irfft(a, n=n, axis=axis, **self._kwargs)
+
+    def fft2(self, a, axes=(-2, -1)):
+        self._notify("fft2")
+        return self._module.fft2(a, axes=axes, **self._kwargs)
+
+    def ifft2(self, a, axes=(-2, -1)):
+        self._notify("ifft2")
+        return self._module.ifft2(a, axes=axes, **self._kwargs)
+
+    # Shifts only reorder the spectrum, they are the same for every backend
+    @staticmethod
+    def fftshift(a, axes=None):
+        return np.fft.fftshift(a, axes=axes)
+
+    @staticmethod
+    def ifftshift(a, axes=None):
+        return np.fft.ifftshift(a, axes=axes)
+
+    # Smallest length >= n with only small prime factors (fast transform size)
+    # Padding changes the circular boundary of a filtering, so it is only applied where the caller discards the
+    # padded border (e.g. the halo of a tile), never to whole-frame filters
+    @staticmethod
+    def next_fast_len(n, real=False):
+        try:
+            from scipy.fft import next_fast_len
+        except ImportError:
+            return _next_smooth_len(n)
+        return next_fast_len(n, real=real)
+
+
+# Smallest 2-3-5-smooth number >= n (fallback of next_fast_len without scipy)
+def _next_smooth_len(n):
+    n = max(1, int(n))
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Default size limit (in bytes) of the filters kept by a FilterBank
+DEFAULT_FILTER_BANK_BYTES = 64 * 1024**2
+
+# Hit/miss statistics of a FilterBank
+FilterBankStats = namedtuple("FilterBankStats", ("hits", "misses", "evictions", "entries", "nbytes", "max_bytes"))
+
+
+class FilterBank:
+    """LRU cache of frequency-domain filters keyed by (kind, cutoff, shape, order), bounded in bytes.
+
+    Filters are stored read-only in their compact 1-D/broadcastable form, so a cached filter costs
+    O(rows) memory whatever the image width. The bank is thread safe.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_FILTER_BANK_BYTES):
+        self.max_bytes = max_bytes
+        self._filters = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    # Returns the cached filter for the key, building it with build() on a miss
+    def get(self, kind, cutoff, shape, order, build):
+        key = (kind, float(cutoff), tuple(shape), int(order))
+        with self._lock:
+            H = self._filters.get(key)
+            if H is not None:
+                self._filters.move_to_end(key)
+                self._hits += 1
+                return H
+            self._misses += 1
+
+        # Built outside the lock, a concurrent miss on the same key only costs a duplicate build
+        H = np.asarray(build())
+        H.setflags(write=False)
+        with self._lock:
+            if key not in self._filters:
+                self._filters[key] = H
+                self._nbytes += H.nbytes
+                self._evict()
+        return H
+
+    # Drops least recently used filters until the bank fits in max_bytes (the newest filter is always kept)
+    def _evict(self):
+        while self._nbytes > self.max_bytes and len(self._filters) > 1:
+            _, H = self._filters.popitem(last=False)
+            self._nbytes -= H.nbytes
+            self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return FilterBankStats(
+                self._hits, self._misses, self._evictions, len(self._filters), self._nbytes, self.max_bytes
+            )
+
+    def clear(self):
+        with self._lock:
+            self._filters.clear()
+            self._nbytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def __len__(self):
+        return len(self._filters)
@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Memory (in bytes) kept by the LRU of prepared frames when none is given
+DEFAULT_FRAME_CACHE_BYTES = 256 * 1024**2
+
+
+class FrameProvider:
+    """Lazy, cached access to the frames of a (C, H, W) stack for display.
+
+    The stack can be any array-like indexable along C (memmap, TifPageStack or ndarray): a frame is only read
+    when it is displayed or prefetched. Prepared frames are transposed, C-contiguous (W, H) arrays (the layout
+    pyqtgraph expects), kept in an LRU of at most max_bytes, keyed by (frame index, pyramid level).
+    Level L of the pyramid is the frame downsampled by 2**L (2x2 block means of level L - 1), used for zoomed-out
+    views. The `prefetch` neighbouring frames of the last requested one are prepared on a background thread.
+    Display levels are estimated once from a sample of frames, so they never need to be recomputed.
+    """
+
+    def __init__(self, stack, max_bytes=DEFAULT_FRAME_CACHE_BYTES, prefetch=2, min_size=64):
+        self.stack = stack
+        self.n_frames, self.rows, self.cols = stack.shape
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.max_level = 0
+        while min(self.rows, self.cols) >> (self.max_level + 1) >= min_size:
+            self.max_level += 1
+        self.levels = self._sample_levels()
+
+        self._frames = OrderedDict()
+        self._nbytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-prefetch")
+
+    # (low, high) display levels: 0.1 and 99.9 percentiles of a strided sample of up to n_samples frames
+    def _sample_levels(self, n_samples=8, max_pixels=512 * 512):
+        step = max(1, int(np.ceil(np.sqrt(self.rows * self.cols / max_pixels))))
+        indices = np.unique(np.linspace(0, self.n_frames - 1, min(n_samples, self.n_frames)).astype(int))
+        sample = np.stack([np.asarray(self.stack[int(k)])[::step, ::step] for k in indices])
+        low, high = np.percentile(sample, (0.1, 99.9))
+        if high <= low:
+            high = low + 1
+        return float(low), float(high)
+
+    # Pyramid level whose resolution matches a view showing `pixels_per_screen_pixel` frame pixels per screen pixel
+    def level_for(self, pixels_per_screen_pixel):
+        if not pixels_per_screen_pixel or pixels_per_screen_pixel <= 1:
+            return 0
+        return int(min(self.max_level, np.floor(np.log2(pixels_per_screen_pixel))))
+
+    # Prepared (W, H) frame at the given pyramid level, then prefetches its neighbours at the same level
+    def frame(self, index, level=0):
+        key = (int(index), int(level))
+        with self._lock:
+            future = self._pending.get(key)
+        result = future.result() if future is not None else self._get(*key)
+        self.prefetch_around(*key)
+        return result
+
+    def prefetch_around(self, index, level=0):
+        for distance in range(1, self.prefetch + 1):
+            for neighbour in (index + distance, index - distance):
+                if not 0 <= neighbour < self.n_frames:
+                    continue
+                key = (neighbour, level)
+                with self._lock:
+                    if key in self._frames or key in self._pending:
+                        continue
+                    self._pending[key] = self._executor.submit(self._prefetch, key)
+
+    def _prefetch(self, key):
+        try:
+            return self._get(*key)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _get(self, index, level):
+        key = (index, level)
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+        if level == 0:
+            prepared = np.ascontiguousarray(np.asarray(self.stack[index]).T)
+        else:
+            prepared = _downsample(self._get(index, level - 1))
+        prepared.setflags(write=False)
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = prepared
+                self._nbytes += prepared.nbytes
+                while self._nbytes > self.max_bytes and len(self._frames) > 1:
+                    _, evicted = self._frames.popitem(last=False)
+                    self._nbytes -= evicted.nbytes
+        return prepared
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._nbytes = 0
+
+    # Stops the prefetching (the stack itself belongs to the caller and stays open)
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.clear()
+
+
+# 2x2 block mean of a 2-D image (an odd last row/column is dropped)
+def _downsample(image):
+    h, w = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    blocks = image[:h, :w].reshape(h // 2, 2, w // 2, 2)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
@@ -0,0 +1,167 @@
+import threading
+
+import imageio.v2 as iio
+import numpy as np
+import tifffile
+
+from microscope_processor import CACHE_BLOCK_BYTES, _metrics_stage, _selection, select_region
+
+# File readers of MicroscopeProcessor.load_tif/load_png, kept out of microscope_processor so the compute core
+# imports without tifffile and imageio (they are imported on the first load)
+
+
+# Lazy (C, H, W) stack over the pages of a TIFF that cannot be memory-mapped (e.g. compressed files)
+# Only the pages requested through indexing are decoded, so the full stack is never resident in memory
+# Reads are serialized, so a viewer and a processing thread can share the same stack
+# channels/roi: optional selection (see microscope_processor.select_region). Only the selected pages are read and,
+# for a ROI, only the strips or tiles overlapping it are decoded
+class TifPageStack:
+
+    def __init__(self, tiff_file_path, channels=None, roi=None):
+        self._tif = tifffile.TiffFile(tiff_file_path)
+        self._lock = threading.Lock()
+        series = self._tif.series[0]
+        self.dtype = series.dtype
+        self._frame_shape = tuple(series.shape[1:])
+        self._set_selection(list(range(series.shape[0])), slice(0, self._frame_shape[0]),
+                            slice(0, self._frame_shape[1]))
+        if channels is not None or roi is not None:
+            self._set_selection(*self._compose(channels, roi))
+
+    def _set_selection(self, pages, rows, cols):
+        self._pages = pages
+        self._rows = rows
+        self._cols = cols
+        self.shape = (len(pages), rows.stop - rows.start, cols.stop - cols.start)
+        self.ndim = len(self.shape)
+
+    # Page indices and frame slices of a selection relative to the current one
+    def _compose(self, channels, roi):
+        channels, rows, cols = _selection(self.shape, channels, roi)
+        pages = self._pages[channels] if isinstance(channels, slice) else [self._pages[k] for k in channels]
+        r0, c0 = self._rows.start, self._cols.start
+        return pages, slice(r0 + rows.start, r0 + rows.stop), slice(c0 + cols.start, c0 + cols.stop)
+
+    # Sub-stack of the selected channels and ROI (relative to this stack), sharing its file: nothing is read
+    def select(self, channels=None, roi=None):
+        view = object.__new__(TifPageStack)
+        view._tif = self._tif
+        view._lock = self._lock
+        view.dtype = self.dtype
+        view._frame_shape = self._frame_shape
+        view._set_selection(*self._compose(channels, roi))
+        return view
+
+    def __len__(self):
+        return self.shape[0]
+
+    # Supports integer and slice indexing along the C axis: stack[k] -> (H, W), stack[k0:k1] -> (n, H, W)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            pages = self._pages[key]
+            if not pages:
+                return np.empty((0,) + tuple(self.shape[1:]), dtype=self.dtype)
+            if self._is_cropped():
+                return np.stack([self._read_page(page) for page in pages])
+            with self._lock:
+                frames = self._tif.asarray(key=pages, series=0)
+            return frames.reshape((len(pages),) + tuple(self.shape[1:]))
+        return self._read_page(self._pages[int(key)])
+
+    def _is_cropped(self):
+        return self.shape[1:] != self._frame_shape
+
+    def _read_page(self, page_index):
+        with self._lock:
+            if not self._is_cropped():
+                return self._tif.asarray(key=page_index, series=0)
+            page = self._tif.series[0].pages[page_index]
+            keyframe = page.keyframe
+            if len(keyframe.chunked) != 2:
+                # Multi-sample or volumetric pages: decoded whole, then cropped
+                return self._tif.asarray(key=page_index, series=0)[self._rows, self._cols]
+            return self._read_region(page, keyframe)
+
+    # Decodes the strips or tiles of the page overlapping the ROI into a (h, w) array
+    def _read_region(self, page, keyframe):
+        rows, cols = self._rows, self._cols
+        chunk_rows, chunk_cols = keyframe.chunks[:2]
+        grid_cols = keyframe.chunked[1]
+        region = np.zeros(self.shape[1:], dtype=self.dtype)
+        indices = [
+            i for i in range(len(page.dataoffsets))
+            if (i // grid_cols) * chunk_rows < rows.stop and (i // grid_cols + 1) * chunk_rows > rows.start
+            and (i % grid_cols) * chunk_cols < cols.stop and (i % grid_cols + 1) * chunk_cols > cols.start
+        ]
+        segments = self._tif.filehandle.read_segments(
+            [page.dataoffsets[i] for i in indices], [page.databytecounts[i] for i in indices], indices=indices
+        )
+        for data, index in segments:
+            segment, (_, _, y, x, _), _ = keyframe.decode(
+                data, index, jpegtables=keyframe.jpegtables, jpegheader=keyframe.jpegheader
+            )
+            if segment is None:
+                continue
+            segment = segment.reshape(segment.shape[1:3])
+            y0, y1 = max(y, rows.start), min(y + segment.shape[0], rows.stop)
+            x0, x1 = max(x, cols.start), min(x + segment.shape[1], cols.stop)
+            region[y0 - rows.start:y1 - rows.start, x0 - cols.start:x1 - cols.start] = segment[
+                y0 - y:y1 - y, x0 - x:x1 - x
+            ]
+        return region
+
+    # Closes the file (shared with the stacks selected from this one)
+    def close(self):
+        self._tif.close()
+
+
+# Method to load a TIFF into a numpy array (see MicroscopeProcessor.load_tif)
+def load_tif(tiff_file_path, mmap=False, progress=None, metrics=None, channels=None, roi=None):
+    with _metrics_stage(metrics, "load_tif"):
+        stack = _open_tif(tiff_file_path, mmap, progress, channels, roi)
+        _count_loaded(metrics, stack)
+    return stack
+
+
+def _open_tif(tiff_file_path, mmap=False, progress=None, channels=None, roi=None):
+    selected = channels is not None or roi is not None
+    if not mmap:
+        if progress is None and not selected:
+            return tifffile.imread(tiff_file_path)
+        return _read_tif_frames(tiff_file_path, progress, channels, roi)
+    try:
+        return select_region(tifffile.memmap(tiff_file_path, mode='r'), channels, roi)
+    except ValueError:
+        return TifPageStack(tiff_file_path, channels, roi)
+
+
+# Reads a TIFF stack (or its selection) in chunks of frames, reporting the frames read when progress is given
+def _read_tif_frames(tiff_file_path, progress=None, channels=None, roi=None, chunk_bytes=CACHE_BLOCK_BYTES * 16):
+    pages = TifPageStack(tiff_file_path, channels, roi)
+    progress = progress or (lambda done, total: None)
+    try:
+        stack = np.empty(pages.shape, dtype=pages.dtype)
+        C = len(pages)
+        chunk_frames = max(1, chunk_bytes // max(1, stack[:1].nbytes))
+        progress(0, C)
+        for k0 in range(0, C, chunk_frames):
+            k1 = min(C, k0 + chunk_frames)
+            stack[k0:k1] = pages[k0:k1]
+            progress(k1, C)
+        return stack
+    finally:
+        pages.close()
+
+
+# Method to load a PNG image into a numpy array (see MicroscopeProcessor.load_png)
+def load_png(png_file_path, metrics=None, roi=None):
+    with _metrics_stage(metrics, "load_png"):
+        img = iio.imread(png_file_path)
+        _count_loaded(metrics, img)
+    return select_region(img, roi=roi, image=True)
+
+
+# Bytes actually read by a load (lazy memmaps and page stacks read nothing up front)
+def _count_loaded(metrics, array):
+    if metrics is not None and isinstance(array, np.ndarray) and not isinstance(array, np.memmap):
+        metrics.increment("bytes_loaded", array.nbytes)
@@ -1,16 +1,144 @@
 # microscope_gui.py
 import sys
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QFileDialog, QComboBox, QLabel, QSlider,
-    QTabWidget, QSpinBox, QMessageBox
+    QTabWidget, QSpinBox, QMessageBox, QProgressBar
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer, QObject, QRunnable, QThreadPool, QRectF, pyqtSignal
 import pyqtgraph as pg
-import numpy as np
 
 # Import your processor (must be in PYTHONPATH / same folder)
-from microscope_processor import MicroscopeProcessor
+from microscope_processor import DemodulationResult, MicroscopeProcessor, ProcessingCancelled
+from frame_provider import FrameProvider
+from result_cache import ResultCache, demodulation_params, projection_params
+
+
+def create_result_cache():
+    """Shared on-disk result cache, or None when the cache folder cannot be created."""
+    try:
+        return ResultCache()
+    except OSError:
+        return None
+
+
+class WorkerSignals(QObject):
+    """Signals of a Worker (a QRunnable cannot emit signals itself)."""
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs task(progress) on a QThreadPool thread and delivers its result through Qt signals.
+
+    progress(done, total) emits the progress signal, and raises ProcessingCancelled once cancel() has been
+    called, so the task stops at its next progress report.
+    """
+
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+        self.signals = WorkerSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def progress(self, done, total):
+        if self._cancel.is_set():
+            raise ProcessingCancelled()
+        self.signals.progress.emit(int(done), int(total))
+
+    def run(self):
+        try:
+            result = self.task(self.progress)
+        except ProcessingCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(f"{type(e).__name__}: {e}")
+        else:
+            # Tasks without progress reports (e.g. a PNG decode) cannot stop early: drop their result
+            if self._cancel.is_set():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+
+class TaskPanel(QWidget):
+    """Progress bar and Cancel button of a tab, running one background Worker at a time.
+
+    The widgets in busy_widgets are disabled while a task runs, so the processor is never used from two threads.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.worker = None
+        self.busy_widgets = []
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        layout.addWidget(self.progress_bar, stretch=1)
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel)
+        layout.addWidget(self.cancel_btn)
+
+    def is_busy(self):
+        return self.worker is not None
+
+    def start(self, label, task, on_finished, error_title="Processing error"):
+        """Run task(progress) in the background, then on_finished(result) on the GUI thread."""
+        if self.is_busy():
+            return False
+        self.worker = Worker(task)
+        self.worker.signals.progress.connect(self._on_progress)
+        self.worker.signals.finished.connect(lambda result: self._on_done(label, result, on_finished))
+        self.worker.signals.failed.connect(lambda message: self._on_failed(label, message, error_title))
+        self.worker.signals.cancelled.connect(lambda: self._finish(f"{label}: cancelled"))
+
+        # Busy indicator until the first progress report
+        self.progress_bar.setRange(0, 0)
+        self.status_label.setText(f"{label}...")
+        self.cancel_btn.setEnabled(True)
+        for widget in self.busy_widgets:
+            widget.setEnabled(False)
+        QThreadPool.globalInstance().start(self.worker)
+        return True
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+
+    def _on_progress(self, done, total):
+        self.progress_bar.setRange(0, max(1, total))
+        self.progress_bar.setValue(done)
+
+    def _on_done(self, label, result, on_finished):
+        self._finish(f"{label}: done")
+        on_finished(result)
+
+    def _on_failed(self, label, message, error_title):
+        self._finish(f"{label}: failed")
+        QMessageBox.critical(self, error_title, f"{label} failed:\n{message}")
+
+    def _finish(self, status):
+        self.worker = None
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+        self.status_label.setText(status)
+        self.cancel_btn.setEnabled(False)
+        for widget in self.busy_widgets:
+            widget.setEnabled(True)
 
 
 def hide_imageview_ui(image_view: pg.ImageView):
@@ -29,6 +157,61 @@ def hide_imageview_ui(image_view: pg.ImageView):
         pass
 
 
+class RoiSelector(QObject):
+    """Checkable "ROI" button showing a rectangle ROI over an ImageView, to process a region only.
+
+    Images are shown transposed (x = column, y = row, one unit per image pixel), so bounds() returns the
+    (row_start, row_stop, col_start, col_stop) selection expected by MicroscopeProcessor, or None when the ROI is off.
+    changed is emitted when the ROI is toggled, moved or resized.
+    """
+    changed = pyqtSignal()
+
+    def __init__(self, image_view, parent=None):
+        super().__init__(parent)
+        self.image_view = image_view
+        self.roi = None
+        self.shape = None
+        self.button = QPushButton("ROI")
+        self.button.setCheckable(True)
+        self.button.setToolTip("Draw a region of interest and process only that region")
+        self.button.toggled.connect(self._toggled)
+
+    def set_image_shape(self, rows, cols):
+        """Size of the displayed image: the ROI is reset to its central half."""
+        self.shape = (rows, cols)
+        self._remove()
+        if self.button.isChecked():
+            self._create()
+
+    def bounds(self):
+        if self.roi is None:
+            return None
+        x, y = self.roi.pos()
+        width, height = self.roi.size()
+        return int(round(y)), int(round(y + height)), int(round(x)), int(round(x + width))
+
+    def _toggled(self, checked):
+        if checked and self.shape is not None:
+            self._create()
+        elif not checked:
+            self._remove()
+        self.changed.emit()
+
+    def _create(self):
+        rows, cols = self.shape
+        self.roi = pg.RectROI(
+            [cols // 4, rows // 4], [max(1, cols // 2), max(1, rows // 2)], pen=pg.mkPen("y", width=2),
+            maxBounds=QRectF(0, 0, cols, rows), snapSize=1, translateSnap=True, scaleSnap=True,
+        )
+        self.roi.sigRegionChangeFinished.connect(lambda roi: self.changed.emit())
+        self.image_view.getView().addItem(self.roi)
+
+    def _remove(self):
+        if self.roi is not None:
+            self.image_view.getView().removeItem(self.roi)
+            self.roi = None
+
+
 class TifTab(QWidget):
     """Tab for TIF stack processing (3 projection algorithms)."""
 
@@ -36,6 +219,10 @@ class TifTab(QWidget):
         super().__init__(parent)
 
         self.stack_img = None
+        self.stack_path = None
+        self.frames = None
+        self.frame_level = 0
+        self.cache = create_result_cache()
         # Create processor
         try:
             self.processor = MicroscopeProcessor()
@@ -67,15 +254,26 @@ class TifTab(QWidget):
         self.process_btn.clicked.connect(self.run_processing)
         controls.addWidget(self.process_btn)
 
+        # Background loading/processing: progress and cancellation
+        self.tasks = TaskPanel()
+        self.tasks.busy_widgets = [self.load_btn, self.method_box, self.process_btn]
+        layout.addWidget(self.tasks)
+
         # Middle: original viewer and slider
         mid = QVBoxLayout()
         layout.addLayout(mid, stretch=1)
 
-        mid.addWidget(QLabel("Original Stack (use slider to preview frames)"))
+        header = QHBoxLayout()
+        mid.addLayout(header)
+        header.addWidget(QLabel("Original Stack (use slider to preview frames)"), stretch=1)
         self.original_view = pg.ImageView()
         hide_imageview_ui(self.original_view)
         mid.addWidget(self.original_view)
 
+        # Optional region of interest: PROCESS then only reads and reduces the pixels inside it
+        self.roi_selector = RoiSelector(self.original_view, self)
+        header.addWidget(self.roi_selector.button)
+
         self.slider = QSlider(Qt.Horizontal)
         self.slider.setMinimum(0)
         self.slider.setMaximum(0)
@@ -83,6 +281,13 @@ class TifTab(QWidget):
         self.slider.valueChanged.connect(self.update_frame)
         mid.addWidget(self.slider)
 
+        # Zooming re-renders the frame at the matching pyramid level, once the view has settled
+        self.level_timer = QTimer(self)
+        self.level_timer.setSingleShot(True)
+        self.level_timer.setInterval(100)
+        self.level_timer.timeout.connect(self.update_frame_level)
+        self.original_view.getView().sigRangeChanged.connect(self.level_timer.start)
+
         # Bottom: processed result
         layout.addWidget(QLabel("Processed Result"))
         self.processed_view = pg.ImageView()
@@ -93,18 +298,38 @@ class TifTab(QWidget):
         path, _ = QFileDialog.getOpenFileName(self, "Select TIF stack", "", "TIF files (*.tif *.tiff)")
         if not path:
             return
-        try:
-            self.stack_img = MicroscopeProcessor.load_tif(path)
-            self.processor.add_stack_img(self.stack_img)
 
+        # The stack is opened lazily (memmap, or page by page for compressed files): frames are only read
+        # when displayed, prefetched or processed
+        def load(progress):
+            stack_img = MicroscopeProcessor.load_tif(path, mmap=True)
+            frames = FrameProvider(stack_img) if getattr(stack_img, "ndim", 0) == 3 else None
+            return stack_img, frames
+
+        self.tasks.start("Loading", load, lambda loaded: self.show_stack(path, *loaded), error_title="Error")
+
+    def show_stack(self, path, stack_img, frames):
+        try:
+            self.processor.add_stack_img(stack_img)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load TIF:\n{e}")
             return
-
-        # display stack in ImageView - ImageView accepts 3D arrays (frames, height, width)
-        # ensure array is numpy and in shape (frames, H, W)
-        if isinstance(self.stack_img, np.ndarray) and self.stack_img.ndim == 3:
-            self.original_view.setImage(self.stack_img[0].T)
+        if self.frames is not None:
+            self.frames.close()
+        if hasattr(self.stack_img, "close"):
+            self.stack_img.close()
+        self.stack_img = stack_img
+        self.stack_path = path
+        self.frames = frames
+
+        # display stack in ImageView - frames come from the lazy frame provider as (W, H) arrays
+        # ensure the stack has shape (frames, H, W)
+        if self.frames is not None:
+            self.frame_level = 0
+            self.roi_selector.set_image_shape(self.frames.rows, self.frames.cols)
+            self.original_view.setImage(
+                self.frames.frame(0), autoLevels=False, levels=self.frames.levels, autoHistogramRange=False
+            )
             n_frames = self.stack_img.shape[0]
             self.slider.setMaximum(max(0, n_frames - 1))
             self.slider.setEnabled(True)
@@ -114,12 +339,23 @@ class TifTab(QWidget):
             QMessageBox.warning(self, "Unexpected data", "Loaded TIF has unexpected shape. Expecting 3D numpy array (C,H,W).")
 
     def update_frame(self):
-        if self.stack_img is None:
+        if self.frames is None:
             return
         idx = self.slider.value()
-        # show single frame (2D) in the ImageView
-        frame = self.stack_img[idx]
-        self.original_view.setImage(frame.T)
+        # show single frame (2D) in the ImageView: prepared (cached, prefetched) frame at the current pyramid
+        # level, with the fixed stack levels, stretched over the full-resolution frame rectangle
+        image_item = self.original_view.getImageItem()
+        image_item.setImage(self.frames.frame(idx, self.frame_level), autoLevels=False, levels=self.frames.levels)
+        image_item.setRect(QRectF(0, 0, self.frames.cols, self.frames.rows))
+
+    def update_frame_level(self):
+        if self.frames is None:
+            return
+        pixel_width, pixel_height = self.original_view.getView().viewPixelSize()
+        level = self.frames.level_for(min(pixel_width, pixel_height))
+        if level != self.frame_level:
+            self.frame_level = level
+            self.update_frame()
 
     def run_processing(self):
         if self.stack_img is None:
@@ -127,20 +363,39 @@ class TifTab(QWidget):
             return
             
         mode = self.method_box.currentText()
+        methods = {
+            "Average Projection": ("average", self.processor.average_projection),
+            "Min-Max Projection": ("max_min", self.processor.max_min_projection),
+            "Weighted Complex Average": ("weighted_complex", self.processor.weighted_complex_average),
+        }
+        if mode not in methods:
+            QMessageBox.warning(self, "Unknown method", "Unknown processing method selected.")
+            return
+        name, method = methods[mode]
+
+        # The ROI is applied as a view of the stack: only its rows and columns are read
+        roi = self.roi_selector.bounds()
         try:
-            if mode == "Average Projection":
-                result = self.processor.average_projection()
-            elif mode == "Min-Max Projection":
-                result = self.processor.max_min_projection()
-            elif mode == "Weighted Complex Average":
-                result = self.processor.weighted_complex_average()
-            else:
-                QMessageBox.warning(self, "Unknown method", "Unknown processing method selected.")
-                return
-        except Exception as e:
-            QMessageBox.critical(self, "Processing error", f"Processing failed:\n{e}")
+            self.processor.add_stack_img(self.stack_img, roi=roi)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid ROI", str(e))
             return
+        params = projection_params(name, **({"roi": roi} if roi is not None else {}))
+
+        def process(progress):
+            self.processor.progress = progress
+            try:
+                if self.cache is not None:
+                    return self.cache.get_or_compute(
+                        self.stack_path, name, params, lambda: {"result": method()}, progress
+                    )["result"]
+                return method()
+            finally:
+                self.processor.progress = None
 
+        self.tasks.start(mode, process, self.show_result)
+
+    def show_result(self, result):
         if result is None:
             QMessageBox.critical(self, "Processing error", "Processing returned None. Check method names.")
             return
@@ -156,6 +411,8 @@ class PngTab(QWidget):
         super().__init__(parent)
 
         self.single_img = None
+        self.single_path = None
+        self.cache = create_result_cache()
         # Create processor
         try:
             self.processor = MicroscopeProcessor()
@@ -198,6 +455,20 @@ class PngTab(QWidget):
         self.process_btn.clicked.connect(self.run_processing)
         controls.addWidget(self.process_btn)
 
+        # Background loading/processing: progress and cancellation
+        self.tasks = TaskPanel()
+        self.tasks.busy_widgets = [self.load_btn, self.process_btn]
+        layout.addWidget(self.tasks)
+
+        # Live preview: T/order changes re-run the demodulation from the cached image spectrum,
+        # once the spin boxes have been idle for a short time
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.preview_parameters)
+        self.period_spin.valueChanged.connect(self.preview_timer.start)
+        self.order_spin.valueChanged.connect(self.preview_timer.start)
+
         # Middle: original + viewer selector for intermediates
         mid = QHBoxLayout()
         layout.addLayout(mid)
@@ -205,11 +476,19 @@ class PngTab(QWidget):
         left_col = QVBoxLayout()
         mid.addLayout(left_col)
 
-        left_col.addWidget(QLabel("Original Image"))
+        header = QHBoxLayout()
+        left_col.addLayout(header)
+        header.addWidget(QLabel("Original Image"), stretch=1)
         self.original_view = pg.ImageView()
         hide_imageview_ui(self.original_view)
         left_col.addWidget(self.original_view)
 
+        # Optional region of interest: the demodulation (and its live preview) then only covers that region
+        self.roi_selector = RoiSelector(self.original_view, self)
+        self.roi_selector.changed.connect(self.preview_timer.start)
+        header.addWidget(self.roi_selector.button)
+        self._processed_roi = None
+
         # Right: single viewer and selector for intermediate images
         right_col = QVBoxLayout()
         mid.addLayout(right_col)
@@ -236,21 +515,44 @@ class PngTab(QWidget):
         path, _ = QFileDialog.getOpenFileName(self, "Select PNG image", "", "PNG files (*.png *.jpg *.jpeg)")
         if not path:
             return
+        self.tasks.start(
+            "Loading",
+            lambda progress: MicroscopeProcessor.load_png(path),
+            lambda single_img: self.show_image(path, single_img),
+            error_title="Error",
+        )
+
+    def show_image(self, path, single_img):
         try:
-            self.single_img = MicroscopeProcessor.load_png(path)
-            self.processor.add_single_img(self.single_img)
+            self.processor.add_single_img(single_img)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load PNG:\n{e}")
             return
+        self.single_img = single_img
+        self.single_path = path
+        self._processed_roi = None
 
         # show original
         self.original_view.setImage(self.single_img.T)
+        self.roi_selector.set_image_shape(*self.single_img.shape[:2])
 
     def run_processing(self):
         if self.single_img is None:
             QMessageBox.warning(self, "No data", "Please load a PNG single image first.")
             return
+        self.render_demodulation(use_cache=True)
 
+    def preview_parameters(self):
+        """Re-render with the current T/order (previews are not written to the result cache)."""
+        if self.single_img is None or self.processor is None:
+            return
+        if self.tasks.is_busy():
+            # Retry once the running task is over
+            self.preview_timer.start()
+            return
+        self.render_demodulation(use_cache=False)
+
+    def render_demodulation(self, use_cache):
         # attempt to create processor if not present
         if self.processor is None:
             try:
@@ -261,20 +563,44 @@ class PngTab(QWidget):
 
         T = int(self.period_spin.value())
         order = int(self.order_spin.value())
+
+        # The ROI is demodulated as a view of the image; its spectrum is only recomputed when the ROI changes
+        roi = self.roi_selector.bounds()
+        if roi != self._processed_roi:
+            try:
+                self.processor.add_single_img(self.single_img, roi=roi)
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid ROI", str(e))
+                return
+            self._processed_roi = roi
+        params = demodulation_params(T, order, **({"roi": roi} if roi is not None else {}))
         
-        try:
-            # Expecting: high_pass_filtered_img, A_mix_img, B_mix_img, A_low_pass_img, B_low_pass_img, fourier_based_img
-            (
-                self._high_pass,
-                self._A_mix,
-                self._B_mix,
-                self._A_lp,
-                self._B_lp,
-                self._final
-            ) = self.processor.fourier_based_demodulation(T, order)
-        except Exception as e:
-            QMessageBox.critical(self, "Processing error", f"Fourier demodulation failed:\n{e}")
-            return
+        def demodulate():
+            return dict(zip(DemodulationResult._fields, self.processor.fourier_based_demodulation(T, order)))
+
+        def process(progress):
+            self.processor.progress = progress
+            try:
+                if use_cache and self.cache is not None:
+                    return self.cache.get_or_compute(
+                        self.single_path, "fourier_based_demodulation", params, demodulate, progress
+                    )
+                return demodulate()
+            finally:
+                self.processor.progress = None
+
+        self.tasks.start("Fourier demodulation", process, self.show_demodulation)
+
+    def show_demodulation(self, results):
+        # Expecting: high_pass_filtered_img, A_mix_img, B_mix_img, A_low_pass_img, B_low_pass_img, fourier_based_img
+        (
+            self._high_pass,
+            self._A_mix,
+            self._B_mix,
+            self._A_lp,
+            self._B_lp,
+            self._final
+        ) = (results[name] for name in DemodulationResult._fields[:6])
 
         # Ensure original is available as well (for convenience)
         if self._final is None:
@@ -288,7 +614,8 @@ class PngTab(QWidget):
         key = self.view_box.currentText()
         arr = None
         if key == "Original":
-            arr = self.single_img
+            # The demodulated input: the whole image or its ROI
+            arr = self.processor.img if self.processor is not None else self.single_img
         elif key == "High-pass Filtered":
             arr = self._high_pass
         elif key == "A_mix":
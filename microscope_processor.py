@@ -1,61 +1,572 @@
-import tifffile
-import imageio.v2 as iio
+import contextlib
+import functools
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
 import numpy as np
-from scipy.signal import butter, freqz
-from scipy.fft import fft2, ifft2, fftshift
-from matplotlib import pyplot as plt    
+
+from fft_backend import FFTBackend
+from filter_bank import FilterBank
+
+# Library version, part of the result cache keys so results of an older implementation are never reused
+__version__ = "0.2.0"
+
+# Memory budget (in bytes) used by the streaming projections when none is configured
+DEFAULT_MEMORY_BUDGET = 256 * 1024**2
+
+# Size (in bytes) of the row bands used by the fused projections on in-memory stacks, so a band stays cache resident
+CACHE_BLOCK_BYTES = 4 * 1024**2
+
+# Frame combination algorithms computed by MicroscopeProcessor.compute_projections
+PROJECTIONS = ("average", "max_min", "weighted_complex")
+
+# Parallel execution modes of the row-tile scheduler
+EXECUTORS = ("thread", "process")
+
+# Complex dtype used by the weighted complex average for each selectable precision
+COMPLEX_PRECISIONS = {"float64": np.complex128, "float32": np.complex64}
+
+# Result bundle of MicroscopeProcessor.compute_projections (None for the projections that were not requested)
+ProjectionResult = namedtuple("ProjectionResult", PROJECTIONS, defaults=(None,) * len(PROJECTIONS))
+
+# Result bundle of the baseband demodulation (None for the intermediates that were not requested)
+DemodulationResult = namedtuple(
+    "DemodulationResult",
+    ("high_pass", "A_mix", "B_mix", "A_low_pass", "B_low_pass", "magnitude", "phase"),
+    defaults=(None,) * 7,
+)
+
+# Result bundle of MicroscopeProcessor.harmonic_projection: harmonic indices and (n_harmonics, H, W) maps
+HarmonicProjection = namedtuple("HarmonicProjection", ("harmonics", "magnitude", "phase"))
+
+
+# Stage `name` of the metrics (a ProcessingMetrics), or a no-op context without metrics
+def _metrics_stage(metrics, name, fft_backend=None):
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.stage(name, fft_backend)
+
+
+# Decorator recording a MicroscopeProcessor method as a stage of self.metrics (named after the method)
+def _instrumented(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics is None:
+            return method(self, *args, **kwargs)
+        with self.metrics.stage(method.__name__, self.fft_backend):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Raised by a progress callback to abort the running projection, demodulation or load
+class ProcessingCancelled(Exception):
+    pass
+
+
+# Normalized selection of a (C, H, W) stack or an (H, W) image of the given shape: (channels, rows, cols)
+# channels: None (all), a slice, a frame index or a sequence of frame indices. Regularly spaced indices become a slice, so the
+# selection stays a view of the stack; channels is None for 2-D shapes
+# roi: None (whole frame) or (row_start, row_stop, col_start, col_stop), clipped to the frame
+# rows and cols are step-1 slices with explicit bounds
+def _selection(shape, channels=None, roi=None):
+    rows, cols = shape[-2:]
+    if roi is None:
+        row_slice, col_slice = slice(0, rows), slice(0, cols)
+    else:
+        if len(roi) != 4:
+            raise ValueError(f"ROI must be (row_start, row_stop, col_start, col_stop), got {roi!r}")
+        r0, r1, c0, c1 = (int(v) for v in roi)
+        r0, r1, c0, c1 = max(0, r0), min(rows, r1), max(0, c0), min(cols, c1)
+        if r0 >= r1 or c0 >= c1:
+            raise ValueError(f"ROI {tuple(roi)} does not overlap the {rows}x{cols} frame")
+        row_slice, col_slice = slice(r0, r1), slice(c0, c1)
+    if len(shape) == 2:
+        if channels is not None:
+            raise ValueError("A channel selection needs a (C, H, W) stack")
+        return None, row_slice, col_slice
+
+    C = shape[0]
+    if channels is None:
+        channels = slice(0, C)
+    elif not isinstance(channels, slice):
+        indices = np.arange(C)[np.atleast_1d(np.asarray(channels, dtype=int))]
+        if indices.size == 0:
+            raise ValueError("The channel selection is empty")
+        steps = np.diff(indices)
+        if indices.size == 1 or (steps[0] > 0 and np.all(steps == steps[0])):
+            step = int(steps[0]) if indices.size > 1 else 1
+            channels = slice(int(indices[0]), int(indices[-1]) + 1, step)
+        else:
+            channels = indices.tolist()
+    if isinstance(channels, slice) and not len(range(*channels.indices(C))):
+        raise ValueError("The channel selection is empty")
+    return channels, row_slice, col_slice
+
+
+# Channel subset and ROI of an array (see _selection). ndarrays and memmaps are sliced as views (an irregular
+# channel list copies the selected region only); other stacks (TifPageStack) provide their own select()
+# image=True: the array is an (H, W) or (H, W, samples) image (e.g. RGB), the ROI applies to its first two axes
+def select_region(array, channels=None, roi=None, image=False):
+    if channels is None and roi is None:
+        return array
+    if image:
+        if channels is not None:
+            raise ValueError("A channel selection needs a (C, H, W) stack")
+        _, rows, cols = _selection(np.shape(array)[:2], roi=roi)
+        return array[rows, cols]
+    if not isinstance(array, np.ndarray):
+        return array.select(channels, roi)
+    channels, rows, cols = _selection(array.shape, channels, roi)
+    if channels is None:
+        return array[rows, cols]
+    if isinstance(channels, slice):
+        return array[channels, rows, cols]
+    return array[:, rows, cols][channels]
+
+
+# Names served lazily from image_io (PEP 562), so importing them does not pull tifffile into the compute core
+_LAZY_ATTRIBUTES = {"TifPageStack": "image_io"}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 class MicroscopeProcessor:
+
+    # Butterworth filters shared by all processors, so repeated frames of the same shape, T and order reuse them
+    # (hit/miss statistics: MicroscopeProcessor.filter_bank.stats())
+    filter_bank = FilterBank()
+
+    # FFT layer used by every Fourier routine (numpy by default, see set_fft_backend)
+    fft_backend = FFTBackend()
+
+    # Selects the FFT implementation for all processors: "numpy", "scipy" (workers=N threads) or "pyfftw"
+    @classmethod
+    def set_fft_backend(cls, name="numpy", workers=None):
+        cls.fft_backend = FFTBackend(name, workers)
+        return cls.fft_backend
+
+    # memory_budget: maximum number of bytes the projections may hold at once (None = whole stack in memory)
+    # Memory-mapped and page-backed stacks are always processed in streaming mode
+    # workers: number of threads/processes reducing row tiles of the stack in parallel (None or 1 = serial)
+    # executor: "thread" (NumPy releases the GIL in the reductions and FFTs) or "process" (stack shared through
+    # its memmap file or multiprocessing.shared_memory). Per-worker memory is bounded like the serial path,
+    # by the cache block size or memory_budget
+    # progress: callable(done, total) called as the projections and demodulations advance (row bands, frames,
+    # tiles or stages). It may raise ProcessingCancelled to abort the computation at that point. With a
+    # progress callback the projections always run band by band, so they can be interrupted
+    # metrics: ProcessingMetrics collecting per-stage timings, allocations and FFT call counts of the projections
+    # and demodulations (None = no instrumentation)
+    def __init__(self, memory_budget=None, workers=None, executor="thread", progress=None, metrics=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}, expected any of {EXECUTORS}")
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.executor = executor
+        self.progress = progress
+        self.metrics = metrics
+        self._img_spectrum = None
+        self._img_spectrum_source = None
         
-    def add_stack_img(self, original_stack_img):
-        self.stack = original_stack_img
+    # channels/roi: optional channel subset and region of interest (row_start, row_stop, col_start, col_stop),
+    # applied as views (see select_region): the projections only read the selected frames and pixels
+    def add_stack_img(self, original_stack_img, channels=None, roi=None):
+        self.stack = select_region(original_stack_img, channels, roi)
         self.C_stack, _, _ = self.stack.shape
         
-    def add_single_img(self, original_single_img):
-        self.img = original_single_img
+    # roi: optional region of interest (row_start, row_stop, col_start, col_stop) of the first two axes, demodulated
+    # as a view
+    def add_single_img(self, original_single_img, roi=None):
+        self.img = select_region(original_single_img, roi=roi, image=True)
+        self._img_spectrum = None
+        self._img_spectrum_source = None
+
+    # Real FFT of self.img along the rows, computed once per image and shared by every demodulation of it
+    # It is recomputed when self.img is replaced (add_single_img or assignment), but the image must not be
+    # modified in place while it is cached
+    def _image_spectrum(self):
+        if self._img_spectrum is None or self._img_spectrum_source is not self.img:
+            with self._stage("image_spectrum"):
+                self._img_spectrum = self.fft_backend.rfft(self.img, axis=-2)
+            self._img_spectrum_source = self.img
+        return self._img_spectrum
 
     # Frame combination algorithm. Average projection: compute the mean across all C frames
     # Computing the sum across axis 0 (C dimension): I_result = Σ_{i=0}^{C-1} I_i(x, y)
+    @_instrumented
     def average_projection(self):
-        return np.sum(self.stack, axis = 0)
+        if self._is_banded():
+            return self._streamed_projection("average")
+        return self._average_reduce(self.stack)
     
     # Frame combination algorithm. Max-min projection: compute the difference between the maximum and minimum intensity projections.
     # Computing the difference accross axis 0 (C dimension): I_result = MAX(I_i(x, y)) - MIN(I_i(x, y))
     # MAX/MIN: for each pixel, gets the one of maximum/minimum intensity across all C frames
+    @_instrumented
     def max_min_projection(self):
-        return np.max(self.stack, axis=0) - np.min(self.stack, axis=0)
+        if self._is_banded():
+            return self._streamed_projection("max_min")
+        return self._max_min_reduce(self.stack)
     
     # Frame combination algorithm. Weighted complex average: compute a weighted sum using complex exponential weights 𝑤𝑘 = exp 𝑖 𝑘 𝜋/𝐶 , and output the magnitude of the result. At the end, take the absolute value as result.
-    def weighted_complex_average(self):
-        # wk = exp(i · k · 2π / C)
-        # k is np.arange(self.C_stack): array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+    # It is the magnitude of the first harmonic of the harmonic projection
+    # low_memory=True contracts real cos/sin weights frame by frame, row band by row band, instead of transforming the
+    # whole (C, H, W) stack
+    # precision="float32" computes with complex64/float32 weights and accumulators (halves memory and bandwidth)
+    @_instrumented
+    def weighted_complex_average(self, low_memory=False, precision="float64"):
+        if low_memory:
+            # Row band by row band (see compute_projections), so only band-sized cos/sin accumulators are live
+            return self.compute_projections(["weighted_complex"], low_memory, precision).weighted_complex
+        return self.harmonic_projection((1,), precision, phase=False).magnitude[0]
+
+    # Frame combination algorithm. Harmonic projection: DFT of every pixel along the C frames, for all requested harmonics
+    # I_h(x, y) = Σ_{k=0}^{C-1} I_k(x, y) exp(i · h · k · 2π / C)
+    # h = 0 is the DC term (sum of the frames), h = 1 the weighted complex average, h > 1 the higher harmonics
+    # All harmonics come from a single real FFT along axis 0 (one pass over the stack, no per-harmonic recomputation)
+    # Returns a HarmonicProjection with (n_harmonics, H, W) magnitude and phase maps (phase=None when phase=False)
+    @_instrumented
+    def harmonic_projection(self, harmonics=(0, 1), precision="float64", phase=True):
+        harmonics = tuple(int(h) for h in harmonics)
+        complex_dtype = self._complex_dtype(precision)
+
+        if isinstance(self.stack, np.ndarray):
+            temp_bytes = np.dtype(precision).itemsize + complex_dtype.itemsize
+            results = self._reduce_row_bands(("harmonics", harmonics, precision, phase), temp_bytes)
+        else:
+            results = self._chunked_harmonics(harmonics, complex_dtype, phase)
+        return HarmonicProjection(harmonics, results["magnitude"], results.get("phase"))
+
+    # Frame combination kernels (private static methods)
+    # They reduce any (C, h, w) block over axis 0, so they serve both the whole stack and the streaming tiles
+    @staticmethod
+    def _average_reduce(stack):
+        return np.sum(stack, axis = 0)
+
+    @staticmethod
+    def _max_min_reduce(stack):
+        return np.max(stack, axis=0) - np.min(stack, axis=0)
+
+    @staticmethod
+    def _weighted_complex_weights(C, harmonic=1):
+        # wk = exp(i · h · k · 2π / C)
+        # k is np.arange(C): array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
         # w_k has a final size of [C] Complex Values
-        w_k = np.exp(1j * np.arange(self.C_stack) * 2 * np.pi / self.C_stack)
-        # w_k[:, None, None]: reshapes w_k from C to C, 1, 1 so we can multiply weights and image at each corresponding channel
-        return np.abs(np.sum(self.stack * w_k[:, None, None], axis = 0))
+        return np.exp(1j * harmonic * np.arange(C) * 2 * np.pi / C)
+
+    @staticmethod
+    def _complex_dtype(precision):
+        if precision not in COMPLEX_PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}, expected any of {tuple(COMPLEX_PRECISIONS)}")
+        return np.dtype(COMPLEX_PRECISIONS[precision])
+
+    @staticmethod
+    def _weighted_complex_reduce(stack, low_memory=False, precision="float64"):
+        if low_memory:
+            return MicroscopeProcessor._weighted_complex_reduce_low_memory(stack, precision)
+        return np.abs(MicroscopeProcessor._harmonic_reduce(stack, (1,), precision)[0])
+
+    # Real FFT along axis 0. rfft uses exp(-i...) weights, so the exp(+i...) sum of harmonic h is the conjugate
+    # of bin h, and harmonics above C/2 are read from the mirrored bin C - h
+    @staticmethod
+    def _harmonic_reduce(stack, harmonics, precision="float64"):
+        C = stack.shape[0]
+        spectrum = MicroscopeProcessor.fft_backend.rfft(np.asarray(stack, dtype=precision), axis=0)
+        coefficients = []
+        for h in harmonics:
+            b = h % C
+            coefficients.append(spectrum[C - b] if b > C // 2 else np.conj(spectrum[b]))
+        return np.stack(coefficients)
+
+    # Low-memory weighted complex average: Re = Σ I_k cos(2πk/C), Im = Σ I_k sin(2πk/C), |w| = hypot(Re, Im)
+    # Only three (H, W) real images are allocated, whatever the number of frames
+    @staticmethod
+    def _weighted_complex_reduce_low_memory(stack, precision="float64"):
+        weights = MicroscopeProcessor._weighted_complex_weights(stack.shape[0])
+        cos_w = weights.real.astype(precision)
+        sin_w = weights.imag.astype(precision)
+        re_img = np.zeros(stack.shape[1:], dtype=precision)
+        im_img = np.zeros(stack.shape[1:], dtype=precision)
+        tmp = np.empty(stack.shape[1:], dtype=precision)
+        for k in range(stack.shape[0]):
+            MicroscopeProcessor._accumulate_cos_sin(re_img, im_img, tmp, stack[k], cos_w[k], sin_w[k])
+        return np.hypot(re_img, im_img)
+
+    @staticmethod
+    def _accumulate_cos_sin(re_img, im_img, tmp, frame, cos_k, sin_k):
+        np.multiply(frame, cos_k, out=tmp)
+        re_img += tmp
+        np.multiply(frame, sin_k, out=tmp)
+        im_img += tmp
+
+    # Streaming mode: used when a memory budget is configured or the stack is not a plain in-memory array
+    def _is_streaming(self):
+        return (
+            self.memory_budget is not None
+            or isinstance(self.stack, np.memmap)
+            or not isinstance(self.stack, np.ndarray)
+        )
+
+    # Parallel mode: the row-tile scheduler is used whenever more than one worker is configured
+    def _is_parallel(self):
+        return (self.workers or 1) > 1
+
+    # Band-by-band projections (compute_projections) instead of the whole-stack kernels
+    def _is_banded(self):
+        return self._is_streaming() or self._is_parallel() or self.progress is not None
+
+    def _stage(self, name):
+        return _metrics_stage(self.metrics, name, self.fft_backend)
+
+    def _report_progress(self, done, total):
+        if self.progress is not None:
+            self.progress(done, total)
+
+    def _budget(self):
+        return DEFAULT_MEMORY_BUDGET if self.memory_budget is None else self.memory_budget
+
+    def _streamed_projection(self, projection):
+        return getattr(self.compute_projections([projection]), projection)
+
+    # Fused frame combination: computes every requested projection in a single pass over the stack
+    # projections: any of PROJECTIONS ("average", "max_min", "weighted_complex")
+    # Returns a ProjectionResult, with None for the projections that were not requested
+    # Array-like stacks (in memory or memmaps) are reduced in row bands spanning all C frames: each band is
+    # read once and all kernels run on it while it is still cache (or budget) resident, so results match the
+    # per-method path exactly. Page-backed stacks are accumulated frame chunk by frame chunk: average and
+    # max-min are still exact, the weighted complex average agrees to floating-point rounding
+    # low_memory and precision configure the weighted complex average (see weighted_complex_average)
+    @_instrumented
+    def compute_projections(self, projections=PROJECTIONS, low_memory=False, precision="float64"):
+        projections = list(dict.fromkeys(projections))
+        unknown = [name for name in projections if name not in PROJECTIONS]
+        if unknown:
+            raise ValueError(f"Unknown projection(s) {unknown}, expected any of {PROJECTIONS}")
+        self._complex_dtype(precision)
+        if isinstance(self.stack, np.ndarray):
+            results = self._band_projections(projections, low_memory, precision)
+        else:
+            results = self._chunked_projections(projections, low_memory, precision)
+        return ProjectionResult(**results)
+
+    def _band_rows(self, temp_bytes_per_voxel):
+        C, _, cols = self.stack.shape
+        # Each band holds the input voxels plus the temporaries of the kernels (complex weighted products)
+        bytes_per_row = C * cols * (np.dtype(self.stack.dtype).itemsize + temp_bytes_per_voxel)
+        block_bytes = self._budget() if self._is_streaming() else CACHE_BLOCK_BYTES
+        return max(1, int(block_bytes // bytes_per_row))
+
+    # Band kernel described by a picklable spec, so process workers can rebuild it (private static method)
+    # ("projections", names, low_memory, precision) or ("harmonics", harmonics, precision, phase)
+    # The kernel maps a (C, h, W) band to named (..., h, W) outputs
+    @staticmethod
+    def _band_reducer(spec):
+        if spec[0] == "projections":
+            _, projections, low_memory, precision = spec
+            reducers = {
+                "average": MicroscopeProcessor._average_reduce,
+                "max_min": MicroscopeProcessor._max_min_reduce,
+                "weighted_complex": lambda band: MicroscopeProcessor._weighted_complex_reduce(
+                    band, low_memory, precision
+                ),
+            }
+            return lambda band: {name: reducers[name](band) for name in projections}
+
+        _, harmonics, precision, phase = spec
+
+        def reduce_band(band):
+            coefficients = MicroscopeProcessor._harmonic_reduce(band, harmonics, precision)
+            results = {"magnitude": np.abs(coefficients)}
+            if phase:
+                results["phase"] = np.angle(coefficients)
+            return results
+
+        return reduce_band
+
+    # Runs the band kernel on every (C, band_rows, W) row band of the stack and stitches its named (..., band_rows, W)
+    # outputs into preallocated (..., H, W) arrays
+    # With workers > 1 the rows are split into contiguous tasks reduced in parallel (see __init__): threads share
+    # the stack directly, processes attach to it through its memmap file or a shared-memory copy and write their
+    # rows into shared-memory outputs, so no worker copies the stack
+    def _reduce_row_bands(self, spec, temp_bytes_per_voxel):
+        _, rows, cols = self.stack.shape
+        band_rows = self._band_rows(temp_bytes_per_voxel)
+        reduce_band = self._band_reducer(spec)
+        # Output layout (leading shape and dtype) from a single-pixel probe
+        probe = reduce_band(np.asarray(self.stack[:, :1, :1]))
+        layouts = {name: (result.shape[:-2] + (rows, cols), result.dtype) for name, result in probe.items()}
+
+        workers = min(self.workers or 1, -(-rows // band_rows))
+        if workers <= 1:
+            results = {name: np.empty(shape, dtype=dtype) for name, (shape, dtype) in layouts.items()}
+            self._reduce_rows(self.stack, reduce_band, results, 0, rows, band_rows,
+                              lambda b1: self._report_progress(b1, rows))
+            return results
+
+        # Several tasks per worker balance the load, each task spans whole cache-sized bands
+        task_rows = band_rows * max(1, -(-rows // (band_rows * workers * 4)))
+        tasks = [(r0, min(rows, r0 + task_rows)) for r0 in range(0, rows, task_rows)]
+
+        if self.executor == "thread":
+            results = {name: np.empty(shape, dtype=dtype) for name, (shape, dtype) in layouts.items()}
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(self._reduce_rows, self.stack, reduce_band, results, r0, r1, band_rows): r1 - r0
+                    for r0, r1 in tasks
+                }
+                self._wait_row_tasks(pool, futures, rows)
+            return results
+
+        handles = []
+        shared_outputs = {}
+        try:
+            stack_spec = _share_array(self.stack, handles)
+            output_specs = {}
+            for name, (shape, dtype) in layouts.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+                handles.append(shm)
+                shared_outputs[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                output_specs[name] = ("shm", shm.name, shape, dtype.str)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(_reduce_rows_worker, stack_spec, output_specs, spec, r0, r1, band_rows): r1 - r0
+                    for r0, r1 in tasks
+                }
+                self._wait_row_tasks(pool, futures, rows)
+            return {name: output.copy() for name, output in shared_outputs.items()}
+        finally:
+            # The views must be released before the shared memory can be closed
+            shared_outputs.clear()
+            for shm in handles:
+                shm.close()
+                shm.unlink()
+
+    # Waits for the row tasks ({future: task rows}), reporting the rows done. On failure or cancellation the
+    # pending tasks are dropped before the exception propagates
+    def _wait_row_tasks(self, pool, futures, rows):
+        done = 0
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += futures[future]
+                self._report_progress(done, rows)
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    # Reduces rows [r0, r1) band by band into the output arrays (private static method)
+    # band_done(b1) is called after each band, when given
+    @staticmethod
+    def _reduce_rows(stack, reduce_band, results, r0, r1, band_rows, band_done=None):
+        for b0 in range(r0, r1, band_rows):
+            b1 = min(r1, b0 + band_rows)
+            for name, band_result in reduce_band(np.asarray(stack[:, b0:b1])).items():
+                results[name][..., b0:b1, :] = band_result
+            if band_done is not None:
+                band_done(b1)
+
+    def _band_projections(self, projections, low_memory=False, precision="float64"):
+        if low_memory:
+            # The cos/sin/scratch accumulators and their hypot are per pixel, i.e. 4 values spread over the C frames
+            temp_bytes = 4 * np.dtype(precision).itemsize / self.stack.shape[0]
+        else:
+            temp_bytes = np.dtype(precision).itemsize + self._complex_dtype(precision).itemsize
+        return self._reduce_row_bands(("projections", tuple(projections), low_memory, precision), temp_bytes)
+
+    # Yields (k, frame) over the whole stack, reading frame chunks that fit in the budget left by the accumulators
+    def _iter_frames(self, acc_bytes):
+        C, rows, cols = self.stack.shape
+        frame_bytes = rows * cols * np.dtype(self.stack.dtype).itemsize
+        chunk_frames = max(1, (self._budget() - acc_bytes) // frame_bytes)
+        for k0 in range(0, C, chunk_frames):
+            self._report_progress(k0, C)
+            for dk, frame in enumerate(self.stack[k0:k0 + chunk_frames]):
+                yield k0 + dk, frame
+        self._report_progress(C, C)
+
+    def _chunked_projections(self, projections, low_memory=False, precision="float64"):
+        C, rows, cols = self.stack.shape
+        dtype = np.dtype(self.stack.dtype)
+        complex_dtype = self._complex_dtype(precision)
+
+        if "average" in projections:
+            sum_img = np.zeros((rows, cols), dtype=np.sum(np.zeros((1, 1), dtype=dtype), axis=0).dtype)
+        if "weighted_complex" in projections:
+            w_k = self._weighted_complex_weights(C)
+            if low_memory:
+                cos_w = w_k.real.astype(precision)
+                sin_w = w_k.imag.astype(precision)
+                re_img = np.zeros((rows, cols), dtype=precision)
+                im_img = np.zeros((rows, cols), dtype=precision)
+                tmp = np.empty((rows, cols), dtype=precision)
+            else:
+                w_k = w_k.astype(complex_dtype)
+                complex_img = np.zeros((rows, cols), dtype=complex_dtype)
+        max_img = min_img = None
+
+        acc_bytes = rows * cols * (8 + 2 * dtype.itemsize + 2 * complex_dtype.itemsize)
+        for k, frame in self._iter_frames(acc_bytes):
+            if "average" in projections:
+                sum_img += frame
+            if "weighted_complex" in projections:
+                if low_memory:
+                    self._accumulate_cos_sin(re_img, im_img, tmp, frame, cos_w[k], sin_w[k])
+                else:
+                    complex_img += frame * w_k[k]
+            if "max_min" in projections:
+                if max_img is None:
+                    max_img, min_img = frame.copy(), frame.copy()
+                else:
+                    np.maximum(max_img, frame, out=max_img)
+                    np.minimum(min_img, frame, out=min_img)
+
+        results = {}
+        if "average" in projections:
+            results["average"] = sum_img
+        if "max_min" in projections:
+            results["max_min"] = max_img - min_img
+        if "weighted_complex" in projections:
+            results["weighted_complex"] = np.hypot(re_img, im_img) if low_memory else np.abs(complex_img)
+        return results
+
+    # Page-backed stacks cannot be transformed along axis 0 without reading every page per band,
+    # so the harmonics are accumulated as direct DFT sums, one complex image per harmonic
+    def _chunked_harmonics(self, harmonics, complex_dtype, phase):
+        C, rows, cols = self.stack.shape
+        weights = np.stack([self._weighted_complex_weights(C, h) for h in harmonics]).astype(complex_dtype)
+        coefficients = np.zeros((len(harmonics), rows, cols), dtype=complex_dtype)
+        for k, frame in self._iter_frames(coefficients.nbytes):
+            for i in range(len(harmonics)):
+                coefficients[i] += frame * weights[i, k]
+        results = {"magnitude": np.abs(coefficients)}
+        if phase:
+            results["phase"] = np.angle(coefficients)
+        return results
     
     # Fourier-based demodulation method
     # Method to plot the spectrum from an image (private static method)
+    # Draws with matplotlib, imported on the first call (see spectrum_plot.py)
     @staticmethod
     def plot_spectrum(img, title, cmap='magma'):
-        F = np.fft.fft2(img)
-        F_shifted = np.fft.fftshift(F)
-        magnitude = np.log1p(np.abs(F_shifted))
-        magnitude = magnitude / np.max(magnitude)
-        plt.imshow(magnitude, cmap=cmap)  # change colormap here
-        plt.title(title)
-        plt.axis('off')
+        from spectrum_plot import plot_spectrum
+        plot_spectrum(img, title, cmap, MicroscopeProcessor.fft_backend)
     
     # Fourier-based demodulation method
-    # Butterworth Low-Pass filter (private static method)
+    # 1-D Butterworth Low-Pass response along the rows, on the centered (fftshift) frequency grid (private static method)
     @staticmethod
-    def _butter_filter_lowpass(cuttoff_frequency, rows, cols, order):
+    def _butter_response_lowpass(cuttoff_frequency, rows, order):
         
         freqs_norm = np.linspace(-0.5, 0.5, rows, endpoint=False)
         
         # Ideal Butterworth filter
         
-        Hy = 1.0 / (1.0 + (np.abs(freqs_norm) / cuttoff_frequency)**(2 * order))
+        Hy = MicroscopeProcessor._butter_response(freqs_norm, cuttoff_frequency, order)
         
         '''
         # butter + freqz filter
@@ -63,6 +574,21 @@ class MicroscopeProcessor:
         _, h = freqz(b, a, worN=rows, whole = True)
         Hy = np.abs(np.fft.fftshift(h))
         '''
+        return Hy
+
+    # Fourier-based demodulation method
+    # Ideal Butterworth Low-Pass response at normalized frequencies freqs_norm (private static method)
+    @staticmethod
+    def _butter_response(freqs_norm, cuttoff_frequency, order):
+        return 1.0 / (1.0 + (np.abs(freqs_norm) / cuttoff_frequency)**(2 * order))
+
+    # Fourier-based demodulation method
+    # Butterworth Low-Pass filter (private static method)
+    @staticmethod
+    def _butter_filter_lowpass(cuttoff_frequency, rows, cols, order):
+        
+        Hy = MicroscopeProcessor._butter_response_lowpass(cuttoff_frequency, rows, order)
+        
         # Convert 1D to 2D
         Hy = Hy[:, np.newaxis]     # (rows, 1)
         Hx = np.ones((1, cols))    # (1, cols)
@@ -79,52 +605,397 @@ class MicroscopeProcessor:
     # Apply filter in Fourier domain (private static method)
     @staticmethod
     def apply_filter(image_input, H):
-        F = np.fft.fft2(image_input)
-        F_shifted = np.fft.fftshift(F)
+        fft = MicroscopeProcessor.fft_backend
+        F = fft.fft2(image_input)
+        F_shifted = fft.fftshift(F)
         F_filtered = F_shifted * H
-        F_ifft = np.fft.ifft2(np.fft.ifftshift(F_filtered))
+        F_ifft = fft.ifft2(fft.ifftshift(F_filtered))
         img_filtered = np.real(F_ifft)
         return img_filtered, F_filtered
 
     # Fourier-based demodulation method
-    def fourier_based_demodulation(self, T, order):
+    # Half-spectrum (rfft layout) of a Butterworth filter that varies only along the rows (private static method)
+    # kind: "lowpass" or "highpass". The real part of the 2-D filtering equals a filtering with the Hermitian-symmetric
+    # part of the response, H_sym[k] = (H[k] + H[-k]) / 2, which differs from H for odd row counts (the centered grid
+    # has no zero bin), so the symmetric response is used before keeping the rows // 2 + 1 non-negative frequencies
+    @staticmethod
+    def _butter_filter_rfft(kind, cuttoff_frequency, rows, order, frame_rows=None):
+        H = MicroscopeProcessor._butter_filter_symmetric(kind, cuttoff_frequency, rows, order, frame_rows)
+        return H[:rows // 2 + 1]
+
+    # Fourier-based demodulation method
+    # Full-length Hermitian-symmetric row response in unshifted (np.fft) order, used to filter complex signals
+    # The centered grid of an odd frame sits half a bin off the np.fft grid, so H_sym(f) = (H(f - δ) + H(f + δ)) / 2
+    # with δ = 1 / (2 · frame_rows) (δ = 0 for even frames). frame_rows (default rows) samples the response of a
+    # frame of that height on a grid of `rows` bins, as the tiles of tiled_demodulation do
+    # Cached in the filter bank as a (rows,) array (private static method)
+    @staticmethod
+    def _butter_filter_symmetric(kind, cuttoff_frequency, rows, order, frame_rows=None):
+        frame_rows = rows if frame_rows is None else frame_rows
+
+        def build():
+            if kind == "highpass":
+                return 1 - MicroscopeProcessor._butter_filter_symmetric(
+                    "lowpass", cuttoff_frequency, rows, order, frame_rows
+                )
+            freqs_norm = np.fft.fftfreq(rows)
+            offset = (frame_rows % 2) / (2 * frame_rows)
+            return 0.5 * (
+                MicroscopeProcessor._butter_response(freqs_norm - offset, cuttoff_frequency, order)
+                + MicroscopeProcessor._butter_response(freqs_norm + offset, cuttoff_frequency, order)
+            )
+
+        MicroscopeProcessor._check_filter_kind(kind)
+        shape = (rows,) if frame_rows == rows else (rows, frame_rows)
+        return MicroscopeProcessor.filter_bank.get(kind + "-symmetric", cuttoff_frequency, shape, order, build)
+
+    # Fourier-based demodulation method
+    # Centered (fftshift layout) row response as a broadcastable (rows, 1) column, the compact form of
+    # _butter_filter_lowpass/_butter_filter_highpass for apply_filter. Cached in the filter bank (private static method)
+    @staticmethod
+    def _butter_filter_centered(kind, cuttoff_frequency, rows, order):
+        def build():
+            if kind == "highpass":
+                return 1 - MicroscopeProcessor._butter_filter_centered("lowpass", cuttoff_frequency, rows, order)
+            return MicroscopeProcessor._butter_response_lowpass(cuttoff_frequency, rows, order)[:, np.newaxis]
+
+        MicroscopeProcessor._check_filter_kind(kind)
+        return MicroscopeProcessor.filter_bank.get(kind + "-centered", cuttoff_frequency, (rows, 1), order, build)
+
+    @staticmethod
+    def _check_filter_kind(kind):
+        if kind not in ("lowpass", "highpass"):
+            raise ValueError(f"Unknown filter kind {kind!r}, expected 'lowpass' or 'highpass'")
+
+    # Fourier-based demodulation method
+    # Separable filtering: 1-D real FFT along the rows (axis -2) only, without fftshift round-trips
+    # Equivalent to np.real(apply_filter(image_input, H)[0]) for a filter H constant along the columns,
+    # as the column transforms cancel out. Works on (H, W) images and (N, H, W) stacks alike
+    # spectrum: precomputed rfft of image_input along axis -2 (not modified), skips the forward transform
+    @staticmethod
+    def apply_row_filter(image_input, H_rfft, spectrum=None):
+        fft = MicroscopeProcessor.fft_backend
+        rows = image_input.shape[-2]
+        if spectrum is None:
+            F = fft.rfft(image_input, axis=-2)
+            F *= H_rfft[:, None]
+        else:
+            F = spectrum * H_rfft[:, None]
+        return fft.irfft(F, n=rows, axis=-2)
+
+    # Fourier-based demodulation method
+    # separable=True (default) filters along the rows only with real 1-D FFTs (apply_row_filter), which matches
+    # the 2-D fft2/ifft2 path (separable=False) to floating-point rounding at a fraction of its cost
+    @_instrumented
+    def fourier_based_demodulation(self, T, order, separable=True):
         
         rows, cols = self.img.shape
         cut_off_frequency = 1 / T    
+        self._report_progress(0, 4)
         
         # 1) High-pass filtering
-        H_high_filter = self._butter_filter_highpass(cut_off_frequency, rows, cols, order)
-        high_filtered_img, _ = MicroscopeProcessor.apply_filter(self.img, H_high_filter)
+        with self._stage("high_pass"):
+            if separable:
+                H_high_filter = self._butter_filter_rfft("highpass", cut_off_frequency, rows, order)
+                high_filtered_img = MicroscopeProcessor.apply_row_filter(
+                    self.img, H_high_filter, self._image_spectrum()
+                )
+            else:
+                H_high_filter = self._butter_filter_centered("highpass", cut_off_frequency, rows, order)
+                high_filtered_img, _ = MicroscopeProcessor.apply_filter(self.img, H_high_filter)
+        self._report_progress(1, 4)
 
         # 2) Frequency downshift via multiplication by sine/cosine references
-        
-        x = np.arange(rows)
-        cos_mod = np.cos(2*np.pi*x / T)
-        sin_mod = np.sin(2*np.pi*x / T)
-            
-        A_mix_img = high_filtered_img * cos_mod[:, None]
-        B_mix_img = high_filtered_img * sin_mod[:, None]
+        with self._stage("mixing"):
+            x = np.arange(rows)
+            cos_mod = np.cos(2*np.pi*x / T)
+            sin_mod = np.sin(2*np.pi*x / T)
+
+            A_mix_img = high_filtered_img * cos_mod[:, None]
+            B_mix_img = high_filtered_img * sin_mod[:, None]
+        self._report_progress(2, 4)
         
         # 3) Low-pass filtering of the A and B signals
         # Retains only the frequency content of interest while discarding high-frequency artifacts
-        H_low_filter = MicroscopeProcessor._butter_filter_lowpass(cut_off_frequency, rows, cols, order)
-        A_low_filtered_img, _ = MicroscopeProcessor.apply_filter(A_mix_img, H_low_filter)
-        B_low_filtered_img, _ = MicroscopeProcessor.apply_filter(B_mix_img, H_low_filter)
+        with self._stage("low_pass"):
+            if separable:
+                H_low_filter = self._butter_filter_rfft("lowpass", cut_off_frequency, rows, order)
+                A_low_filtered_img = MicroscopeProcessor.apply_row_filter(A_mix_img, H_low_filter)
+                B_low_filtered_img = MicroscopeProcessor.apply_row_filter(B_mix_img, H_low_filter)
+            else:
+                H_low_filter = MicroscopeProcessor._butter_filter_centered("lowpass", cut_off_frequency, rows, order)
+                A_low_filtered_img, _ = MicroscopeProcessor.apply_filter(A_mix_img, H_low_filter)
+                B_low_filtered_img, _ = MicroscopeProcessor.apply_filter(B_mix_img, H_low_filter)
+        self._report_progress(3, 4)
         
         # 4) Magnitude reconstruction
         # Combine the filtered A and B components:
-        img_result = np.sqrt(A_low_filtered_img**2 + B_low_filtered_img**2)
+        with self._stage("magnitude"):
+            img_result = np.sqrt(A_low_filtered_img**2 + B_low_filtered_img**2)
+        self._report_progress(4, 4)
 
         return high_filtered_img, A_mix_img, B_mix_img, A_low_filtered_img, B_low_filtered_img, img_result
     
+    # Fourier-based demodulation method. Complex baseband variant
+    # The high-passed image is mixed with a single complex reference: z = high_pass · exp(-i·2πx/T) = A_mix - i·B_mix.
+    # As the low-pass response is real and symmetric, LP(z) = A_low_pass - i·B_low_pass, so one complex low-pass
+    # replaces the two A/B filterings and gives the magnitude |LP(z)| and the phase map arg(LP(z)) directly
+    # intermediates=True also returns the high-pass, A/B mix and A/B low-pass images (None otherwise)
+    # Returns a DemodulationResult
+    @_instrumented
+    def baseband_demodulation(self, T, order, intermediates=False):
+        if self.img.ndim != 2:
+            raise ValueError(f"Demodulation expects a 2-D (H, W) image, got shape {self.img.shape}")
+        self._report_progress(0, 1)
+        result = MicroscopeProcessor._baseband_demodulate(
+            self.img, T, order, intermediates, spectrum=self._image_spectrum()
+        )
+        self._report_progress(1, 1)
+        return result
+
+    # Parameter sweep of the demodulation over every (T, order) pair. The forward FFT of the image is computed
+    # once and reused by all pairs, and the filters come from the filter bank, so a pair costs one inverse real
+    # FFT and one complex FFT round-trip along the rows (baseband method)
+    # Returns a DemodulationResult whose magnitude (and phase when phase=True) is a (len(periods), len(orders), H, W)
+    # array, [i, j] being the demodulation with periods[i] and orders[j]
+    @_instrumented
+    def demodulation_sweep(self, periods, orders, phase=False):
+        if self.img.ndim != 2:
+            raise ValueError(f"Demodulation expects a 2-D (H, W) image, got shape {self.img.shape}")
+        spectrum = self._image_spectrum()
+        shape = (len(periods), len(orders)) + self.img.shape
+        magnitude = np.empty(shape, dtype=np.float64)
+        phase_maps = np.empty(shape, dtype=np.float64) if phase else None
+        for i, T in enumerate(periods):
+            for j, order in enumerate(orders):
+                self._report_progress(i * len(orders) + j, len(periods) * len(orders))
+                result = MicroscopeProcessor._baseband_demodulate(self.img, T, order, spectrum=spectrum, phase=phase)
+                magnitude[i, j] = result.magnitude
+                if phase:
+                    phase_maps[i, j] = result.phase
+        self._report_progress(len(periods) * len(orders), len(periods) * len(orders))
+        return DemodulationResult(magnitude=magnitude, phase=phase_maps)
+
+    # Fourier-based demodulation of a whole stack or time-lapse: every (H, W) frame of an (N, H, W) input is
+    # demodulated with the baseband method, using transforms batched over the frames of each chunk
+    # images: (N, H, W) array, memmap or TifPageStack (default: the stack set by add_stack_img)
+    # chunk_frames: frames transformed at once (default: as many as fit in the memory budget)
+    # Returns a DemodulationResult of (N, H, W) arrays (intermediates only when intermediates=True)
+    @_instrumented
+    def demodulate_stack(self, T, order, images=None, chunk_frames=None, intermediates=False):
+        images = self.stack if images is None else images
+        N, rows, cols = images.shape
+        if chunk_frames is None:
+            # Per pixel: the float64 high-pass, complex baseband signal, spectrum and low-pass (~64 bytes)
+            chunk_frames = max(1, self._budget() // (rows * cols * 64))
+
+        results = {}
+        for k0 in range(0, N, chunk_frames):
+            self._report_progress(k0, N)
+            k1 = min(N, k0 + chunk_frames)
+            chunk_result = self._baseband_demodulate(np.asarray(images[k0:k1]), T, order, intermediates)
+            for name, chunk_img in chunk_result._asdict().items():
+                if chunk_img is None:
+                    continue
+                if name not in results:
+                    results[name] = np.empty((N, rows, cols), dtype=chunk_img.dtype)
+                results[name][k0:k1] = chunk_img
+        self._report_progress(N, N)
+        return DemodulationResult(**results)
+
+    # Fourier-based demodulation of images larger than memory (e.g. stitched whole-slide images)
+    # The filters act along the rows only, so column tiles are independent and exact. Row tiles are extended by
+    # `halo` rows on each side (overlap-save), taken with wrap-around so the tiles see the same circular signal as
+    # the full frame, filtered with the full-frame response and mixed with the reference at their global row index;
+    # only the tile core is kept.
+    # The halo defaults to the support of the cascaded high-pass/low-pass impulse responses (relative amplitude
+    # 1e-7), and the trailing halo is grown so every tile transform has a fast FFT length.
+    # image: (H, W) array or memmap (default: the image set by add_single_img)
+    # out, phase_out: None (allocate), a .npy path (written through a memmap) or any array-like supporting slice
+    # assignment (np.memmap, zarr, h5py). The phase map is only computed when phase=True
+    # Memory use is proportional to the tile size, not to the image size. Returns a DemodulationResult
+    @_instrumented
+    def tiled_demodulation(self, T, order, image=None, tile_rows=2048, tile_cols=2048, halo=None,
+                           out=None, phase=False, phase_out=None):
+        image = self.img if image is None else image
+        rows, cols = image.shape
+        if halo is None:
+            halo = MicroscopeProcessor._demodulation_halo(T, order)
+
+        if tile_rows + 2 * halo >= rows:
+            # The whole height fits in one tile: full-frame transforms along the rows, no halo needed
+            tile_rows, halo_top, halo_bottom = rows, 0, 0
+        else:
+            halo_top = halo
+            halo_bottom = self.fft_backend.next_fast_len(tile_rows + 2 * halo, real=True) - tile_rows - halo
+
+        out = MicroscopeProcessor._output_array(out, (rows, cols))
+        if phase:
+            phase_out = MicroscopeProcessor._output_array(phase_out, (rows, cols))
+
+        for r0 in range(0, rows, tile_rows):
+            self._report_progress(r0, rows)
+            r1 = min(rows, r0 + tile_rows)
+            # Global row indices of the extended tile, wrapped like the full-frame circular filtering
+            x = np.arange(r0 - halo_top, r1 + halo_bottom) % rows
+            core = slice(halo_top, halo_top + r1 - r0)
+            for c0 in range(0, cols, tile_cols):
+                c1 = min(cols, c0 + tile_cols)
+                if halo_top == 0 and halo_bottom == 0:
+                    tile = np.asarray(image[r0:r1, c0:c1])
+                else:
+                    tile = np.asarray(image[x, c0:c1])
+                tile_result = MicroscopeProcessor._baseband_demodulate(
+                    tile, T, order, x=x, frame_rows=rows, phase=phase
+                )
+                out[r0:r1, c0:c1] = tile_result.magnitude[core]
+                if phase:
+                    phase_out[r0:r1, c0:c1] = tile_result.phase[core]
+
+        for array in (out, phase_out):
+            if isinstance(array, np.memmap):
+                array.flush()
+        self._report_progress(rows, rows)
+        return DemodulationResult(magnitude=out, phase=phase_out if phase else None)
+
+    # Number of rows over which the cascaded high-pass and low-pass impulse responses are significant
+    # (private static method)
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _demodulation_halo(T, order, tolerance=1e-7):
+        n = max(1 << 14, 64 * int(np.ceil(T)))
+        H = MicroscopeProcessor._butter_filter_rfft("lowpass", 1 / T, n, order)
+        h = np.abs(np.fft.irfft(H, n=n)[:n // 2])
+        support = int(np.nonzero(h > tolerance * h.max())[0].max()) + 1
+        return 2 * support
+
+    # Output of the tiled demodulation: allocated, .npy memmap created at a path, or the given array (private static method)
+    @staticmethod
+    def _output_array(out, shape):
+        if out is None:
+            return np.empty(shape, dtype=np.float64)
+        if isinstance(out, (str, os.PathLike)):
+            return np.lib.format.open_memmap(out, mode='w+', dtype=np.float64, shape=shape)
+        if tuple(out.shape) != tuple(shape):
+            raise ValueError(f"Output has shape {tuple(out.shape)}, expected {tuple(shape)}")
+        return out
+
+    # Baseband demodulation along axis -2 of (H, W) images or (N, H, W) stacks (private static method)
+    # x: global row index of every row of img, for the mixing reference (default: 0 .. rows - 1)
+    # spectrum: precomputed rfft of img along axis -2 (see apply_row_filter). phase=False skips the phase map (None)
+    @staticmethod
+    def _baseband_demodulate(img, T, order, intermediates=False, x=None, frame_rows=None, spectrum=None, phase=True):
+        rows = img.shape[-2]
+        cut_off_frequency = 1 / T
+
+        # 1) High-pass filtering
+        H_high_filter = MicroscopeProcessor._butter_filter_rfft("highpass", cut_off_frequency, rows, order, frame_rows)
+        high_filtered_img = MicroscopeProcessor.apply_row_filter(img, H_high_filter, spectrum)
+
+        # 2) Frequency downshift via multiplication by the complex reference exp(-i·2πx/T)
+        x = np.arange(rows) if x is None else x
+        reference = np.exp(-2j * np.pi * x / T)
+        baseband_img = high_filtered_img * reference[:, None]
+
+        # 3) Low-pass filtering of the complex baseband signal (full complex FFT along the rows)
+        H_low_filter = MicroscopeProcessor._butter_filter_symmetric(
+            "lowpass", cut_off_frequency, rows, order, frame_rows
+        )
+        fft = MicroscopeProcessor.fft_backend
+        F = fft.fft(baseband_img, axis=-2)
+        F *= H_low_filter[:, None]
+        low_filtered_img = fft.ifft(F, axis=-2)
+
+        # 4) Magnitude and phase reconstruction
+        result = DemodulationResult(
+            magnitude=np.abs(low_filtered_img), phase=np.angle(low_filtered_img) if phase else None
+        )
+        if intermediates:
+            result = result._replace(
+                high_pass=high_filtered_img,
+                A_mix=high_filtered_img * reference.real[:, None],
+                B_mix=high_filtered_img * -reference.imag[:, None],
+                A_low_pass=low_filtered_img.real,
+                B_low_pass=-low_filtered_img.imag,
+            )
+        return result
+
     # Method to load a TIFF into a numpy array
     # Input shape is (C, H, W), with C = 10
+    # mmap=True opens the stack without reading it: a read-only memmap when the pixel data are stored
+    # uncompressed and contiguous, a page-by-page TifPageStack otherwise (both are processed in streaming mode)
+    # progress: callable(done, total) called as the frames are read (it may raise ProcessingCancelled)
+    # metrics: ProcessingMetrics recording the load as a "load_tif" stage (bytes_loaded counts the frames read)
+    # channels/roi: channel subset and region of interest (see select_region). Only the selected pages, and the
+    # strips or tiles overlapping the ROI, are read; with mmap=True the result is a view of the file
+    # The readers live in image_io.py, imported on the first load so the compute core does not need tifffile
     @staticmethod
-    def load_tif(tiff_file_path):
-        return tifffile.imread(tiff_file_path)
-    
+    def load_tif(tiff_file_path, mmap=False, progress=None, metrics=None, channels=None, roi=None):
+        import image_io
+        return image_io.load_tif(tiff_file_path, mmap, progress, metrics, channels, roi)
+
     # Method to load a PNG image into a numpy array
     # Input shape is (H, W)
+    # metrics: ProcessingMetrics recording the load as a "load_png" stage
+    # roi: region of interest (see select_region) of the first two axes (colour images keep their samples), returned
+    # as a view of the decoded image (PNG has no random access)
     @staticmethod
-    def load_png(png_file_path):
-        return iio.imread(png_file_path)
\ No newline at end of file
+    def load_png(png_file_path, metrics=None, roi=None):
+        import image_io
+        return image_io.load_png(png_file_path, metrics, roi)
+
+
+# Describes an array so a worker process can attach to it without copying: the memmap file of C-contiguous
+# memmaps, otherwise a shared-memory copy (whose handle is appended to `handles` for cleanup)
+def _share_array(array, handles):
+    if isinstance(array, np.memmap) and array.filename and array.flags.c_contiguous:
+        offset = _memmap_offset(array)
+        if offset is not None:
+            return ("memmap", array.filename, offset, array.shape, array.dtype.str)
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    handles.append(shm)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return ("shm", shm.name, array.shape, array.dtype.str)
+
+
+# File offset of the first element of a memmap. Views (e.g. mm[k0:k1]) keep the offset of the memmap they were
+# sliced from, so it is the offset of the root memmap (the one mapping the file, found through the base chain)
+# plus the distance between the data pointers. None when the root is not a memmap of the same file
+def _memmap_offset(array):
+    root = array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap) or root.filename != array.filename:
+        return None
+    return root.offset + array.ctypes.data - root.ctypes.data
+
+
+# Attaches to an array described by _share_array, returns (array, handle to close or None)
+def _attach_array(spec):
+    if spec[0] == "memmap":
+        _, filename, offset, shape, dtype = spec
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape), None
+    _, name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+# Process pool task of MicroscopeProcessor._reduce_row_bands: reduces rows [r0, r1) of the shared stack
+# into the shared outputs
+def _reduce_rows_worker(stack_spec, output_specs, spec, r0, r1, band_rows):
+    stack, stack_handle = _attach_array(stack_spec)
+    results = {}
+    handles = [stack_handle]
+    for name, output_spec in output_specs.items():
+        results[name], handle = _attach_array(output_spec)
+        handles.append(handle)
+    try:
+        MicroscopeProcessor._reduce_rows(stack, MicroscopeProcessor._band_reducer(spec), results, r0, r1, band_rows)
+    finally:
+        # The views must be released before the shared memory can be closed
+        del stack
+        results.clear()
+        for handle in handles:
+            if handle is not None:
+                handle.close()
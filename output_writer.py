@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+
+# Selectable output formats and their file extensions
+OUTPUT_FORMATS = {"tiff": ".tif", "ome-tiff": ".ome.tif", "zarr": ".zarr", "png": ".png"}
+
+# Selectable sample types: float32, uint16 (linearly rescaled, see _to_uint16) or the dtype of the result
+OUTPUT_DTYPES = ("float32", "uint16", "native")
+
+# Selectable compressions (zstd needs imagecodecs for TIFF output)
+OUTPUT_COMPRESSIONS = ("none", "zlib", "lzma", "zstd")
+
+
+class OutputWriter:
+    """Writes result images at native depth on a background I/O thread pool.
+
+    format: "tiff" (default), "ome-tiff", "zarr" (chunked, requires the zarr package) or "png" (8-bit gray
+    quick-look rendered with matplotlib, the former output of run_processing.py).
+    dtype: "float32" (default), "uint16" or "native" (the dtype of the result, e.g. float64).
+    uint16 output is rescaled from [min, max] to [0, 65535]; value = offset + scale · sample, with offset and scale
+    stored in the file metadata (TIFF description, OME image Description as JSON, or zarr attributes).
+    compression: None/"none", "zlib", "lzma" or "zstd" (TIFF/OME-TIFF), any value enables the default zarr codec.
+
+    submit() returns at once with a Future resolving to (path, seconds), so the caller computes the next result
+    while the previous ones are encoded and written. At most max_pending images are queued; submit() blocks
+    beyond that, which bounds the memory held by pending writes.
+
+        with OutputWriter("tiff", "float32", "zlib") as writer:
+            writer.submit("out/avg_projection_img", average)
+    """
+
+    def __init__(self, format="tiff", dtype="float32", compression=None, workers=2, max_pending=8):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format {format!r}, expected any of {tuple(OUTPUT_FORMATS)}")
+        if dtype not in OUTPUT_DTYPES:
+            raise ValueError(f"Unknown output dtype {dtype!r}, expected any of {OUTPUT_DTYPES}")
+        compression = None if compression in (None, "none") else compression
+        if compression is not None and compression not in OUTPUT_COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}, expected any of {OUTPUT_COMPRESSIONS}")
+        self.format = format
+        self.dtype = dtype
+        self.compression = compression
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="output-writer")
+
+    @property
+    def extension(self):
+        return OUTPUT_FORMATS[self.format]
+
+    # Queues the image for writing at `path` (the format extension is appended). Returns a Future of (path, seconds)
+    def submit(self, path, image):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._timed_write, path, image)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _timed_write(self, path, image):
+        t0 = time.perf_counter()
+        path = self.write(path, image)
+        return path, time.perf_counter() - t0
+
+    # Writes the image synchronously, returns the written path
+    def write(self, path, image):
+        path = path + self.extension
+        image = np.asarray(image)
+        if self.format == "png":
+            from matplotlib import pyplot as plt
+            plt.imsave(path, image, cmap='gray')
+            return path
+
+        data, metadata = self._convert(image)
+        if self.format == "zarr":
+            _write_zarr(path, data, metadata, self.compression)
+        elif self.format == "ome-tiff":
+            ome_metadata = {"axes": "YX"}
+            if metadata:
+                ome_metadata["Description"] = json.dumps(metadata)
+            tifffile.imwrite(path, data, ome=True, compression=self.compression, metadata=ome_metadata)
+        else:
+            tifffile.imwrite(path, data, compression=self.compression, metadata=metadata)
+        return path
+
+    def _convert(self, image):
+        if self.dtype == "uint16":
+            return _to_uint16(image)
+        if self.dtype == "float32":
+            return image.astype(np.float32, copy=False), {}
+        return image, {}
+
+    # Waits for the pending writes and stops the pool
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Linear rescale of [min, max] to the full uint16 range, returns (data, {"offset": min, "scale": step})
+def _to_uint16(image):
+    finite = image[np.isfinite(image)]
+    low = float(finite.min()) if finite.size else 0.0
+    high = float(finite.max()) if finite.size else 0.0
+    scale = (high - low) / 65535 if high > low else 1.0
+    data = np.nan_to_num((image - low) / scale, nan=0.0, posinf=65535, neginf=0.0)
+    return np.clip(np.rint(data), 0, 65535).astype(np.uint16), {"offset": low, "scale": scale}
+
+
+# Chunked zarr array (zarr 2 and 3). compression=None disables the codec, any other value keeps zarr's default
+def _write_zarr(path, data, metadata, compression, chunk=512):
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError("The 'zarr' output format requires the zarr package to be installed") from e
+    kwargs = {}
+    if compression is None:
+        kwargs["compressors" if int(zarr.__version__.split(".")[0]) >= 3 else "compressor"] = None
+    array = zarr.open_array(
+        store=path, mode="w", shape=data.shape, chunks=(min(chunk, data.shape[0]), min(chunk, data.shape[1])),
+        dtype=data.dtype, **kwargs
+    )
+    array[...] = data
+    array.attrs.update(metadata)
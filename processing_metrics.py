@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class ProcessingMetrics:
+    """Opt-in instrumentation of MicroscopeProcessor: per-stage timers, allocations and FFT call counts.
+
+    Pass an instance as MicroscopeProcessor(metrics=...) (or metrics=... to load_tif/load_png). Stages nest:
+    a stage opened inside another one is recorded as "parent/child". For every stage name the metrics keep the
+    number of calls, the total wall time, the peak of traced memory above the memory in use when the stage
+    started (track_memory=True, through tracemalloc) and the counters incremented while it was open
+    (e.g. "fft.rfft" calls, "bytes_loaded").
+    callback(event) is called at the end of every stage with a dict describing that single run.
+
+    One ProcessingMetrics instruments one processor used from one thread at a time; FFTs run by parallel row
+    tasks inside a stage are counted in that stage (thread executor only: process workers are not observed).
+    Only one instrumented processor may run per process at a time: FFT calls are observed on the class-wide
+    MicroscopeProcessor.fft_backend, whatever thread runs them, and tracemalloc is process-wide (a stage resets
+    its peak). Instrumented processors running concurrently in threads would count each other's FFTs and reset
+    each other's peaks, so give them separate processes (as run_processing.py does, one per worker).
+    """
+
+    def __init__(self, track_memory=False, callback=None):
+        self.track_memory = track_memory
+        self.callback = callback
+        self.stages = {}
+        self.counters = {}
+        self._open = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    # Context manager timing the stage `name`. fft_backend: FFTBackend whose calls are counted while it is open
+    @contextmanager
+    def stage(self, name, fft_backend=None):
+        outermost = not self._open
+        if outermost:
+            if self.track_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            if fft_backend is not None:
+                fft_backend.add_listener(self._count_fft)
+
+        path = f"{self._open[-1]['path']}/{name}" if self._open else name
+        frame = {"path": path, "counters": {}, "start_memory": 0, "peak_memory": 0}
+        if self.track_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                parent = self._open[-1]
+                parent["peak_memory"] = max(parent["peak_memory"], peak)
+            tracemalloc.reset_peak()
+            frame["start_memory"] = frame["peak_memory"] = current
+        self._open.append(frame)
+
+        t0 = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            seconds = time.perf_counter() - t0
+            self._open.pop()
+            peak_bytes = None
+            if self.track_memory:
+                frame["peak_memory"] = max(frame["peak_memory"], tracemalloc.get_traced_memory()[1])
+                peak_bytes = frame["peak_memory"] - frame["start_memory"]
+                if self._open:
+                    self._open[-1]["peak_memory"] = max(self._open[-1]["peak_memory"], frame["peak_memory"])
+            self._record(path, seconds, peak_bytes, frame["counters"])
+
+            if outermost:
+                if fft_backend is not None:
+                    fft_backend.remove_listener(self._count_fft)
+                if self._started_tracing:
+                    tracemalloc.stop()
+                    self._started_tracing = False
+
+    def _record(self, path, seconds, peak_bytes, counters):
+        with self._lock:
+            stats = self.stages.setdefault(path, {"calls": 0, "seconds": 0.0, "peak_bytes": None, "counters": {}})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            if peak_bytes is not None:
+                stats["peak_bytes"] = max(stats["peak_bytes"] or 0, peak_bytes)
+            for counter, value in counters.items():
+                stats["counters"][counter] = stats["counters"].get(counter, 0) + value
+        if self.callback is not None:
+            self.callback({"stage": path, "seconds": seconds, "peak_bytes": peak_bytes, "counters": dict(counters)})
+
+    # Adds value to the counter, in the totals and in every open stage
+    def increment(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+            for frame in self._open:
+                frame["counters"][counter] = frame["counters"].get(counter, 0) + value
+
+    def _count_fft(self, kind):
+        self.increment(f"fft.{kind}")
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "stages": {path: dict(stats, counters=dict(stats["counters"])) for path, stats in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    # JSON export; also written to `path` when given
+    def to_json(self, path=None, indent=2):
+        text = json.dumps(self.to_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
@@ -0,0 +1,517 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from microscope_processor import DemodulationResult, EXECUTORS, MicroscopeProcessor, PROJECTIONS, ProjectionResult
+from worker_setup import init_worker, parse_size
+
+# Operations of a processing request
+OPERATIONS = ("projections", "demodulation")
+
+# Demodulation methods: fourier_based_demodulation ("standard") or baseband_demodulation ("baseband")
+DEMODULATION_METHODS = ("standard", "baseband")
+
+# Address served when none is given: localhost TCP port (a path selects a Unix socket instead)
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+# Names of the shared-memory segments currently created by the ProcessingClients of this process (see
+# _attach_shared_memory)
+_CLIENT_SEGMENTS = set()
+
+# Exceptions of a request reported to the client as a bad request (HTTP 400) rather than a service failure
+REQUEST_ERRORS = (ValueError, KeyError, TypeError, IndexError, FileNotFoundError)
+
+
+class ServiceError(RuntimeError):
+    """Failed request, with the HTTP status returned by the service."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+
+class ServiceBusy(ServiceError):
+    """The service queue is full (HTTP 503): nothing was processed and the request can be retried later."""
+
+    def __init__(self, message="Processing queue is full"):
+        super().__init__(message, 503)
+
+
+class ServiceMetrics:
+    """Request counters, latency percentiles and throughput of a ProcessingService (thread-safe).
+
+    Latencies (acceptance to result), queue waits and compute times are kept for the last `window` requests.
+    Throughput is given over the whole uptime and over the last `recent_seconds`.
+    """
+
+    def __init__(self, window=1024, recent_seconds=60.0):
+        self.recent_seconds = recent_seconds
+        self.started = time.time()
+        self.counts = {"accepted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.operations = {}
+        self.in_flight = 0
+        self._filter_banks = {}
+        self._requests = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def accepted(self, operation):
+        with self._lock:
+            self.counts["accepted"] += 1
+            self.operations[operation] = self.operations.get(operation, 0) + 1
+            self.in_flight += 1
+
+    def rejected(self):
+        with self._lock:
+            self.counts["rejected"] += 1
+
+    # Records the end of an accepted request. info: worker report (queue wait, compute time, filter bank stats)
+    def finished(self, ok, latency, info=None):
+        info = info or {}
+        with self._lock:
+            self.in_flight -= 1
+            self.counts["completed" if ok else "failed"] += 1
+            if ok:
+                self._requests.append((time.time(), latency, info.get("queue_seconds"), info.get("compute_seconds")))
+            if "worker" in info:
+                self._filter_banks[info["worker"]] = info["filter_bank"]
+
+    def to_dict(self):
+        with self._lock:
+            uptime = time.time() - self.started
+            requests = list(self._requests)
+            filter_banks = list(self._filter_banks.values())
+            result = {
+                "uptime_seconds": uptime,
+                "requests": dict(self.counts),
+                "operations": dict(self.operations),
+                "in_flight": self.in_flight,
+                "throughput_per_s": self.counts["completed"] / uptime if uptime > 0 else 0.0,
+            }
+        recent = [request for request in requests if request[0] >= time.time() - self.recent_seconds]
+        result["recent_throughput_per_s"] = len(recent) / min(self.recent_seconds, max(uptime, 1e-9))
+        for name, column in (("latency_seconds", 1), ("queue_seconds", 2), ("compute_seconds", 3)):
+            result[name] = _summary([request[column] for request in requests if request[column] is not None])
+        result["filter_bank"] = {
+            key: sum(stats[key] for stats in filter_banks) for key in ("hits", "misses", "entries", "nbytes")
+        }
+        return result
+
+
+class ProcessingService:
+    """Long-running MicroscopeProcessor service with a warm worker pool.
+
+    The pool is started (and warmed up: imports, FFT code paths) once, so a request only pays for its own
+    computation. Filters stay cached in the filter bank of every worker between requests.
+    workers: number of worker processes (executor="process") or threads (executor="thread"), default: all cores.
+    queue_size: requests accepted beyond the busy workers. When workers + queue_size requests are in flight,
+    submit() raises ServiceBusy at once instead of queueing more (backpressure, HTTP 503 over the server).
+    memory_budget: per-request budget of the projections; path inputs are then memory-mapped (streaming mode).
+    max_memory: address-space limit of each worker process.
+
+    A request is a JSON-compatible dict:
+        {"operation": "projections", "path": "stack.tif", "params": {"projections": ["average"], "roi": [...]}}
+        {"operation": "demodulation", "shared_memory": {"name": ..., "shape": [H, W], "dtype": "<f8"},
+         "params": {"T": 16, "order": 8, "method": "baseband"}}
+    params: projections, low_memory, precision, channels, roi (projections) or T, order, method, intermediates,
+    roi (demodulation). Shared-memory inputs are owned by the client, which must keep them alive until the answer.
+
+        with ProcessingService(workers=4) as service:
+            arrays, info = service.process({"operation": "projections", "path": "stack.tif"})
+    """
+
+    def __init__(self, workers=None, queue_size=16, executor="process", fft_backend="numpy", fft_workers=None,
+                 memory_budget=None, max_memory=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}, expected any of {EXECUTORS}")
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.executor = executor
+        self.memory_budget = memory_budget
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        if executor == "process":
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(max_memory, fft_backend, fft_workers)
+            )
+        else:
+            MicroscopeProcessor.set_fft_backend(fft_backend, fft_workers)
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="processing-service")
+        wait([self._pool.submit(_warm_up) for _ in range(self.workers)])
+
+    # Queues the request, returns a Future of (arrays as npz bytes, worker info). Raises ServiceBusy when the queue
+    # is full and ValueError for malformed requests (before anything is queued)
+    def submit(self, request):
+        _validate_request(request)
+        if not self._slots.acquire(blocking=False):
+            self.metrics.rejected()
+            raise ServiceBusy()
+        self.metrics.accepted(request["operation"])
+        accepted = time.time()
+        try:
+            future = self._pool.submit(_run_request, request, self.memory_budget, accepted)
+        except BaseException:
+            self._slots.release()
+            self.metrics.finished(False, 0.0)
+            raise
+        future.add_done_callback(lambda done: self._done(done, accepted))
+        return future
+
+    def _done(self, future, accepted):
+        self._slots.release()
+        failed = future.cancelled() or future.exception() is not None
+        self.metrics.finished(not failed, time.time() - accepted, None if failed else future.result()[1])
+
+    # Runs the request synchronously, returns ({name: array}, worker info)
+    def process(self, request):
+        payload, info = self.submit(request).result()
+        return unpack_arrays(payload), info
+
+    def close(self, wait=True):
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP front-end of a ProcessingService: POST /process (JSON request, npz answer), GET /metrics, GET /health."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            metrics = self.server.service.metrics.to_dict()
+            metrics.update(workers=self.server.service.workers, queue_size=self.server.service.queue_size,
+                           executor=self.server.service.executor)
+            self._send_json(200, metrics)
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/process":
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            future = self.server.service.submit(json.loads(body))
+        except ServiceBusy as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        except REQUEST_ERRORS as e:
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            payload, info = future.result()
+        except REQUEST_ERRORS as e:
+            self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, payload, "application/octet-stream", {"X-Processing-Info": json.dumps(info)})
+
+    def _send_json(self, status, content, headers=None):
+        self._send(status, json.dumps(content).encode(), "application/json", headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Unix socket peers have no (host, port) address
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # Also removes the socket file
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+# HTTP server of the service on "host:port" or on a Unix socket path (any address containing "/").
+# Call serve_forever() on it (shutdown() and server_close() stop it)
+def create_server(service, address=DEFAULT_ADDRESS, verbose=False):
+    if _is_socket_path(address):
+        if os.path.exists(address):
+            os.remove(address)
+        server = _UnixHTTPServer(address, _RequestHandler)
+    else:
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), _RequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class ProcessingClient:
+    """Client of a running processing service ("host:port" or Unix socket path).
+
+    Sources are file paths (read by the service) or numpy arrays, passed through shared memory: the array is
+    copied once into a segment the service reads in place. Every call uses its own connection, so one client can be
+    shared by concurrent threads. A full service queue raises ServiceBusy (retry later), failed requests ServiceError.
+
+        client = ProcessingClient("/tmp/microscope.sock")
+        result = client.projections("stack.tif", ["average", "max_min"], roi=(0, 512, 0, 512))
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        self.address = address
+        self.timeout = timeout
+
+    # Returns a ProjectionResult (None for the projections that were not requested)
+    def projections(self, source, projections=PROJECTIONS, low_memory=False, precision="float64", channels=None,
+                    roi=None):
+        params = {"projections": list(projections), "low_memory": low_memory, "precision": precision,
+                  "channels": channels, "roi": roi}
+        return ProjectionResult(**self.process("projections", source, params))
+
+    # Returns a DemodulationResult (intermediates only when intermediates=True, phase with the baseband method)
+    def demodulation(self, source, T, order, method="standard", intermediates=False, roi=None):
+        params = {"T": T, "order": order, "method": method, "intermediates": intermediates, "roi": roi}
+        return DemodulationResult(**self.process("demodulation", source, params))
+
+    # Runs one request, returns {name: array}
+    def process(self, operation, source, params):
+        request = {"operation": operation, "params": {key: value for key, value in params.items() if value is not None}}
+        if isinstance(source, (str, os.PathLike)):
+            request["path"] = os.path.abspath(source)
+            return unpack_arrays(self._post(request))
+
+        array = np.asarray(source)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        _CLIENT_SEGMENTS.add(shm.name)
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            request["shared_memory"] = {"name": shm.name, "shape": list(array.shape), "dtype": array.dtype.str}
+            return unpack_arrays(self._post(request))
+        finally:
+            _CLIENT_SEGMENTS.discard(shm.name)
+            shm.close()
+            shm.unlink()
+
+    def metrics(self):
+        return json.loads(self._call("GET", "/metrics"))
+
+    def _post(self, request):
+        return self._call("POST", "/process", json.dumps(request).encode(), {"Content-Type": "application/json"})
+
+    def _call(self, method, path, body=None, headers=None):
+        connection = self._connect()
+        try:
+            connection.request(method, path, body, headers or {})
+            response = connection.getresponse()
+            content = response.read()
+        finally:
+            connection.close()
+        if response.status == 503:
+            raise ServiceBusy(json.loads(content)["error"])
+        if response.status != 200:
+            raise ServiceError(json.loads(content)["error"], response.status)
+        return content
+
+    def _connect(self):
+        if _is_socket_path(self.address):
+            return _UnixHTTPConnection(self.address, self.timeout)
+        host, port = self.address.rsplit(":", 1)
+        return http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _is_socket_path(address):
+    return "/" in str(address)
+
+
+# npz (uncompressed) encoding of the result arrays
+def pack_arrays(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def unpack_arrays(payload):
+    with np.load(io.BytesIO(payload)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+def _validate_request(request):
+    if not isinstance(request, dict):
+        raise ValueError("A request must be a JSON object")
+    if request.get("operation") not in OPERATIONS:
+        raise ValueError(f"Unknown operation {request.get('operation')!r}, expected any of {OPERATIONS}")
+    if ("path" in request) == ("shared_memory" in request):
+        raise ValueError("A request needs exactly one input: 'path' or 'shared_memory'")
+
+
+# Worker warm-up: imports the file readers and runs the FFT and filter code paths once
+def _warm_up():
+    import image_io  # noqa: F401
+    processor = MicroscopeProcessor()
+    processor.add_single_img(np.zeros((32, 32)))
+    processor.fourier_based_demodulation(16, 2)
+    return os.getpid()
+
+
+# Worker task: runs one request, returns (npz bytes, info). accepted: time.time() when the service accepted it
+def _run_request(request, memory_budget, accepted):
+    started = time.time()
+    shm = None
+    try:
+        if "path" in request:
+            source = request["path"]
+        else:
+            spec = request["shared_memory"]
+            shm = _attach_shared_memory(spec["name"])
+            source = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=shm.buf)
+        arrays = _compute(request["operation"], source, request.get("params", {}), memory_budget)
+        # The view of the segment must be released before it can be closed
+        source = None
+    finally:
+        if shm is not None:
+            shm.close()
+    payload = pack_arrays(arrays)
+    info = {
+        "worker": os.getpid(),
+        "queue_seconds": started - accepted,
+        "compute_seconds": time.time() - started,
+        "filter_bank": MicroscopeProcessor.filter_bank.stats()._asdict(),
+    }
+    return payload, info
+
+
+# Projections of a (C, H, W) stack or demodulation of an (H, W) image, given as a file path or an array
+def _compute(operation, source, params, memory_budget):
+    processor = MicroscopeProcessor(memory_budget=memory_budget)
+    roi = params.get("roi")
+    if operation == "projections":
+        channels = params.get("channels")
+        stack = source
+        if isinstance(source, str):
+            # Only the selected frames, and the strips or tiles of the ROI, are read from the file
+            stack = MicroscopeProcessor.load_tif(source, mmap=memory_budget is not None, channels=channels, roi=roi)
+            channels = roi = None
+        try:
+            processor.add_stack_img(stack, channels=channels, roi=roi)
+            result = processor.compute_projections(
+                params.get("projections", PROJECTIONS), params.get("low_memory", False),
+                params.get("precision", "float64")
+            )
+        finally:
+            # A TifPageStack (compressed file in streaming mode) releases its file with the request
+            if stack is not source and hasattr(stack, "close"):
+                stack.close()
+        return {name: value for name, value in result._asdict().items() if value is not None}
+
+    method = params.get("method", "standard")
+    if method not in DEMODULATION_METHODS:
+        raise ValueError(f"Unknown demodulation method {method!r}, expected any of {DEMODULATION_METHODS}")
+    if isinstance(source, str):
+        source = MicroscopeProcessor.load_png(source, roi=roi)
+        roi = None
+    processor.add_single_img(source, roi=roi)
+    T, order, intermediates = params["T"], int(params["order"]), params.get("intermediates", False)
+    if method == "baseband":
+        result = processor.baseband_demodulation(T, order, intermediates)._asdict()
+    else:
+        result = dict(zip(DemodulationResult._fields, processor.fourier_based_demodulation(T, order)))
+        if not intermediates:
+            result = {"magnitude": result["magnitude"]}
+    return {name: value for name, value in result.items() if value is not None}
+
+
+# Attaches to a client's shared-memory segment. The client owns it: Python < 3.13 registers attached segments
+# with the resource tracker, which would unlink them when the worker exits, so they are unregistered (except
+# for a client in this process, e.g. of a thread-executor service, whose registration is the tracker's only one)
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if name not in _CLIENT_SEGMENTS:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+# Count, mean and percentiles of a list of durations (None when empty)
+def _summary(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"count": len(values), "mean": float(values.mean()), "p50": float(p50), "p95": float(p95),
+            "p99": float(p99), "max": float(values.max())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Persistent local MicroscopeProcessor service")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS,
+                        help="host:port to listen on, or a Unix socket path (any address containing '/')")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(), help="Number of warm workers")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="Requests queued beyond the busy workers before answering 503 (backpressure)")
+    parser.add_argument("--executor", choices=EXECUTORS, default="process")
+    parser.add_argument("--memory-budget", type=parse_size, help="Per-request memory budget, e.g. 1G (enables streaming)")
+    parser.add_argument("--max-memory", type=parse_size, help="Per-worker memory limit, e.g. 2G")
+    parser.add_argument("--fft-backend", choices=("numpy", "scipy", "pyfftw"), default="numpy")
+    parser.add_argument("--fft-workers", type=int, help="FFT threads per worker (scipy/pyfftw backends)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log every HTTP request")
+    args = parser.parse_args(argv)
+
+    service = ProcessingService(args.workers, args.queue_size, args.executor, args.fft_backend, args.fft_workers,
+                                args.memory_budget, args.max_memory)
+    server = create_server(service, args.address, args.verbose)
+    print(f"Serving {service.workers} {args.executor} workers on {args.address} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close(wait=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from microscope_processor import __version__
+
+# Cache folder used when none is given (overridable with the MICROSCOPE_CACHE_DIR environment variable)
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MICROSCOPE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "microscope_processor")
+)
+
+# Size limit (in bytes) of the cache folder when none is given
+DEFAULT_CACHE_BYTES = 2 * 1024**3
+
+_HASH_CHUNK_BYTES = 16 * 1024**2
+
+
+class ResultCache:
+    """Persistent, content-addressed cache of processing results, shared by the CLI, the GUI and the Python API.
+
+    Entries are keyed by the SHA-256 of the input content, the method name, its parameters and the library
+    version, and stored as one .npz file of named arrays. The least recently used entries and stored file hashes
+    are evicted when the folder grows past max_bytes. Writes are atomic, so several processes can share the same
+    folder.
+
+        cache = ResultCache()
+        results = cache.get_or_compute("stack.tif", "compute_projections", {"projections": ["average"]},
+                                       lambda: {"average": processor.average_projection()})
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES, compress=False):
+        self.directory = directory or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    # SHA-256 of the input content: a file path or an array
+    # File hashes are memoized on path, size and modification time, in memory and in the cache folder, so a file is
+    # only read for hashing the first time it is seen (by any process sharing the folder)
+    # progress(done, total) is called after each chunk of a file hashed, so a long hash can report and be cancelled
+    def content_hash(self, source, progress=None):
+        if isinstance(source, (str, os.PathLike)):
+            path = os.path.abspath(source)
+            stat = os.stat(path)
+            memo_key = (path, stat.st_size, stat.st_mtime_ns)
+            if memo_key not in self._file_hashes:
+                self._file_hashes[memo_key] = self._stored_hash(memo_key) or self._hash_file(memo_key, progress)
+            return self._file_hashes[memo_key]
+
+        array = np.asarray(source)
+        digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+        flat = array.reshape(-1)
+        step = max(1, _HASH_CHUNK_BYTES // max(1, array.itemsize))
+        for i in range(0, flat.size, step):
+            digest.update(np.ascontiguousarray(flat[i:i + step]).data)
+        return digest.hexdigest()
+
+    def _hash_path(self, memo_key):
+        name = hashlib.sha256(json.dumps(memo_key).encode()).hexdigest()
+        return os.path.join(self.directory, "hashes", name + ".sha256")
+
+    def _stored_hash(self, memo_key):
+        path = self._hash_path(memo_key)
+        try:
+            with open(path) as f:
+                content_hash = f.read().strip() or None
+            # Reading refreshes the hash file for the LRU eviction, like an entry
+            os.utime(path)
+        except OSError:
+            return None
+        return content_hash
+
+    def _hash_file(self, memo_key, progress=None):
+        path, size, _ = memo_key
+        chunks = max(1, -(-size // _HASH_CHUNK_BYTES))
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for i, chunk in enumerate(iter(lambda: f.read(_HASH_CHUNK_BYTES), b"")):
+                digest.update(chunk)
+                if progress is not None:
+                    progress(min(i + 1, chunks), chunks)
+        content_hash = digest.hexdigest()
+        hash_path = self._hash_path(memo_key)
+        os.makedirs(os.path.dirname(hash_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(hash_path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(content_hash)
+        os.replace(tmp_path, hash_path)
+        return content_hash
+
+    # progress: see content_hash
+    def key(self, source, method, params=None, progress=None):
+        description = {
+            "input": self.content_hash(source, progress),
+            "method": method,
+            "params": params or {},
+            "version": __version__,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    # Cached arrays of the key as a dict, or None on a miss
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                results = {name: data[name] for name in data.files}
+            # Reading refreshes the entry for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return results
+
+    # Stores a dict of arrays (None values are skipped) under the key
+    def put(self, key, results):
+        arrays = {name: np.asarray(value) for name, value in results.items() if value is not None}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                (np.savez_compressed if self.compress else np.savez)(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    # Cached results of method(params) on the input, computed with compute() -> dict of arrays on a miss
+    # progress: reports the hashing of a file input (see content_hash)
+    def get_or_compute(self, source, method, params, compute, progress=None):
+        key = self.key(source, method, params, progress)
+        results = self.get(key)
+        if results is None:
+            results = {name: value for name, value in compute().items() if value is not None}
+            self.put(key, results)
+        return results
+
+    # (modification time, size, path) of the entries and of the stored file hashes
+    def _files(self):
+        files = []
+        hashes = os.path.join(self.directory, "hashes")
+        for folder, suffix in ((self.directory, ".npz"), (hashes, ".sha256")):
+            try:
+                entries = list(os.scandir(folder))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(suffix):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    # Removes the least recently used entries and file hashes until the folder fits in max_bytes (the hashes of
+    # modified or deleted inputs are never read again, so they age out like unused entries)
+    def _evict(self):
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                os.remove(entry.path)
+        shutil.rmtree(os.path.join(self.directory, "hashes"), ignore_errors=True)
+
+
+# Cache parameters of one projection: only the weighted complex average depends on the precision and the
+# low-memory mode, so the other projections are shared between runs that differ in those options
+# kwargs: further parameters of the result, e.g. the channel subset and ROI of the input
+def projection_params(name, low_memory=False, precision="float64", **kwargs):
+    if name == "weighted_complex":
+        return dict({"low_memory": bool(low_memory), "precision": precision}, **kwargs)
+    return dict(kwargs)
+
+
+# Cache parameters of a demodulation (T as float so the GUI spin box and the CLI share entries)
+def demodulation_params(T, order, **kwargs):
+    return dict({"T": float(T), "order": int(order)}, **kwargs)
@@ -1,117 +1,316 @@
-from microscope_processor import MicroscopeProcessor
-from matplotlib import pyplot as plt
+import argparse
+import glob
+import json
 import os
-
-# Input images
-input_tif_image = "input_images/background_removal_raw.tif"
-input_png_image = "input_images/a.png"
-
-# Output image folder
-output_folder = "output_images/"
-os.makedirs(output_folder, exist_ok=True)
-
-# Importing the original TIF image
-original_stack_img = MicroscopeProcessor.load_tif(input_tif_image)
-original_single_img = MicroscopeProcessor.load_png(input_png_image)
-
-# Creating an instance of the MicroscopeProcessor class
-processor = MicroscopeProcessor()
-processor.add_stack_img(original_stack_img)
-processor.add_single_img(original_single_img)  
-
-# ------------ Frame combination algorithm 
-
-# Average projection
-avg_projection_img = processor.average_projection()
-
-# Min-Max projection
-min_max_projection_img = processor.max_min_projection()
-
-# Weighted complex average
-weighted_complex_avg_img = processor.weighted_complex_average()
-
-# ------------ Fourier-based demodulation
-
-# Period (in pixels)
-T = 16
-order = 8
-
-high_pass_filtered_img, A_mix_img, B_mix_img, A_low_pass_img, B_low_pass_img, fourier_based_img = processor.fourier_based_demodulation(T, order)
-
-# ------------ Plot processed images
-
-plt.figure(1, figsize=(12,4))
-
-# Frame combination algorithm
-plt.subplot(1,3,1)
-plt.imshow(avg_projection_img, cmap='gray')
-plt.title("Average Projection")
-
-plt.subplot(1,3,2)
-plt.imshow(min_max_projection_img, cmap='gray')
-plt.title("Min-Max Projection")
-
-plt.subplot(1,3,3)
-plt.imshow(weighted_complex_avg_img, cmap='gray')
-plt.title("Weighted Complex Average")
-
-# Fourier-based demodulation
-
-plt.figure(2, figsize=(12,4))
-
-plt.subplot(2,3,1)
-plt.imshow(high_pass_filtered_img, cmap='gray')
-plt.title("High-Pass Filtered Image")
-
-plt.subplot(2,3,2)
-plt.imshow(A_mix_img, cmap='gray')
-plt.title("A_mix Image")
-
-plt.subplot(2,3,3)
-plt.imshow(B_mix_img, cmap='gray')
-plt.title("B_mix Image")
-
-plt.subplot(2,3,4)
-plt.imshow(A_low_pass_img, cmap='gray')
-plt.title("Low-Pass Filtered A_mix Image")
-
-plt.subplot(2,3,5)
-plt.imshow(B_low_pass_img, cmap='gray')
-plt.title("Low-Pass Filtered B_mix Image")
-
-plt.subplot(2,3,6)
-plt.imshow(fourier_based_img, cmap='gray')
-plt.title("Fourier-Based Demodulation Image")
-
-# Fourier-based demodulation (Spectrum)
-
-plt.figure(3, figsize=(12,4))
-
-plt.subplot(1,4,1)
-MicroscopeProcessor.plot_spectrum(original_single_img, "Original Image", cmap='magma')
-plt.title("Original Image")
-
-plt.subplot(1,4,2)
-MicroscopeProcessor.plot_spectrum(high_pass_filtered_img, "Original Image", cmap='magma')
-plt.title("High-Pass Filtered Image")
-
-plt.subplot(1,4,3)
-MicroscopeProcessor.plot_spectrum(A_low_pass_img, "Original Image", cmap='magma')
-plt.title("Low-Pass Filtered A_mix Image")
-
-plt.subplot(1,4,4)
-MicroscopeProcessor.plot_spectrum(B_low_pass_img, "Original Image", cmap='magma')
-plt.title("Low-Pass Filtered B_mix Image")
-
-plt.show()
-
-# ------------ Save processed images
-plt.imsave(output_folder + "avg_projection_img.png", avg_projection_img, cmap='gray')
-plt.imsave(output_folder+ "min_max_projection_img.png", min_max_projection_img, cmap='gray')
-plt.imsave(output_folder + "weighted_complex_avg_img.png", weighted_complex_avg_img, cmap='gray')
-plt.imsave(output_folder + "high_pass_filtered_img.png", high_pass_filtered_img, cmap='gray')
-plt.imsave(output_folder+ "A_mix_img.png", A_mix_img, cmap='gray')
-plt.imsave(output_folder + "B_mix_img.png", B_mix_img, cmap='gray')
-plt.imsave(output_folder + "A_low_pass_img.png", A_low_pass_img, cmap='gray')
-plt.imsave(output_folder+ "B_low_pass_img.png", B_low_pass_img, cmap='gray')
-plt.imsave(output_folder + "fourier_based_img.png", fourier_based_img, cmap='gray')
\ No newline at end of file
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless batch processing: never require a display
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+from microscope_processor import DemodulationResult, MicroscopeProcessor, PROJECTIONS
+from output_writer import OUTPUT_COMPRESSIONS, OUTPUT_DTYPES, OUTPUT_FORMATS, OutputWriter
+from processing_metrics import ProcessingMetrics
+from result_cache import DEFAULT_CACHE_BYTES, DEFAULT_CACHE_DIR, ResultCache, demodulation_params, projection_params
+from worker_setup import init_worker, parse_size
+
+# Default inputs (used when no input is given on the command line)
+DEFAULT_INPUTS = ["input_images/background_removal_raw.tif", "input_images/a.png"]
+
+TIF_EXTENSIONS = (".tif", ".tiff")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Output file name of every projection
+PROJECTION_OUTPUTS = {
+    "average": "avg_projection_img",
+    "max_min": "min_max_projection_img",
+    "weighted_complex": "weighted_complex_avg_img",
+}
+
+# Output file names of the Fourier-based demodulation, in the order returned by fourier_based_demodulation
+DEMODULATION_OUTPUTS = (
+    "high_pass_filtered_img",
+    "A_mix_img",
+    "B_mix_img",
+    "A_low_pass_img",
+    "B_low_pass_img",
+    "fourier_based_img",
+)
+
+# Every output file name process_file may write (whatever the format)
+OUTPUT_NAMES = frozenset(PROJECTION_OUTPUTS.values()) | frozenset(DEMODULATION_OUTPUTS) | {"fourier_based_phase_img"}
+
+
+# Expands the input globs and the manifest (one path per line, or a JSON list of paths) into a sorted file list
+def collect_inputs(patterns, manifest=None):
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        paths.extend(matches if matches else [pattern])
+    if manifest:
+        with open(manifest) as f:
+            text = f.read()
+        if manifest.endswith(".json"):
+            paths.extend(json.loads(text))
+        else:
+            paths.extend(line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#"))
+    return sorted(dict.fromkeys(paths))
+
+
+# Output folder of every input: its path relative to the common folder of the inputs, without extension, so that
+# a/stack.tif and b/stack.tif do not collide. Raises ValueError when two inputs map to the same folder
+# (e.g. stack.tif and stack.png)
+def output_folders(paths, output):
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    folders = {}
+    owners = {}
+    for path in paths:
+        relative = os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0]
+        folder = os.path.normpath(os.path.join(output, relative))
+        if folder in owners:
+            raise ValueError(f"{owners[folder]} and {path} would both be written to {folder}")
+        owners[folder] = path
+        folders[path] = folder
+    return folders
+
+
+# Removes the outputs of earlier runs left in the folder that this run does not overwrite (outputs of other
+# projections, options or formats), so the folder only holds the results of the latest run. Other files are kept
+def remove_stale_outputs(folder, current):
+    for entry in os.listdir(folder):
+        path = os.path.join(folder, entry)
+        if entry.split(".")[0] in OUTPUT_NAMES and path not in current:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+# Processes one input file. TIF stacks get the frame combination projections, single images the
+# Fourier-based demodulation. Results found in the result cache are reused instead of recomputed (the input is
+# not even loaded when every result is cached). The outputs are queued on the writer, whose pending futures are
+# kept in record["writes"] (see process_batch). Returns a summary record with per-stage timings (never raises)
+def process_file(path, options, writer):
+    record = {"path": path, "status": "ok", "timings": {}, "outputs": [], "cache_hits": 0, "writes": []}
+    timings = record["timings"]
+    start = time.perf_counter()
+    try:
+        output_folder = options["folders"][path]
+        os.makedirs(output_folder, exist_ok=True)
+        streaming = options["memory_budget"] is not None
+        metrics = ProcessingMetrics(track_memory=True) if options["metrics"] else None
+        processor = MicroscopeProcessor(memory_budget=options["memory_budget"], metrics=metrics)
+        cache = ResultCache(options["cache_dir"], options["cache_size"]) if options["cache_dir"] else None
+        roi = options["roi"]
+        results = {}
+
+        if path.lower().endswith(TIF_EXTENSIONS):
+            record["kind"] = "stack"
+            t0 = time.perf_counter()
+            keys = {}
+            projections = {}
+            channels = options["channels"]
+            selection = {key: value for key, value in (("channels", channels), ("roi", roi)) if value is not None}
+            if cache is not None:
+                for name in options["projections"]:
+                    params = projection_params(name, options["low_memory"], options["precision"], **selection)
+                    keys[name] = cache.key(path, name, params)
+                    cached = cache.get(keys[name])
+                    if cached is not None:
+                        projections[name] = cached["result"]
+                record["cache_hits"] = len(projections)
+                timings["cache"] = time.perf_counter() - t0
+
+            missing = [name for name in options["projections"] if name not in projections]
+            if missing:
+                t0 = time.perf_counter()
+                processor.add_stack_img(MicroscopeProcessor.load_tif(
+                    path, mmap=streaming, metrics=metrics, channels=channels, roi=roi
+                ))
+                timings["load"] = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                computed = processor.compute_projections(missing, options["low_memory"], options["precision"])
+                for name in missing:
+                    projections[name] = getattr(computed, name)
+                    if cache is not None:
+                        cache.put(keys[name], {"result": projections[name]})
+                timings["projections"] = time.perf_counter() - t0
+            for name in options["projections"]:
+                results[PROJECTION_OUTPUTS[name]] = projections[name]
+        else:
+            record["kind"] = "image"
+            T, order = options["period"], options["order"]
+            baseband = options["demodulation"] == "baseband"
+
+            def compute():
+                t0 = time.perf_counter()
+                processor.add_single_img(MicroscopeProcessor.load_png(path, metrics=metrics, roi=roi))
+                timings["load"] = time.perf_counter() - t0
+                if baseband:
+                    return processor.baseband_demodulation(T, order, intermediates=options["intermediates"])._asdict()
+                return dict(zip(DemodulationResult._fields, processor.fourier_based_demodulation(T, order)))
+
+            t0 = time.perf_counter()
+            if cache is None:
+                demodulation = compute()
+            else:
+                method = "baseband_demodulation" if baseband else "fourier_based_demodulation"
+                selection = {"roi": roi} if roi is not None else {}
+                params = demodulation_params(T, order, intermediates=options["intermediates"], **selection) \
+                    if baseband else demodulation_params(T, order, **selection)
+                demodulation = cache.get_or_compute(path, method, params, compute)
+                record["cache_hits"] = int("load" not in timings)
+            timings["demodulation"] = time.perf_counter() - t0 - timings.get("load", 0.0)
+
+            results["fourier_based_img"] = demodulation["magnitude"]
+            if baseband:
+                results["fourier_based_phase_img"] = demodulation["phase"]
+            if options["intermediates"]:
+                intermediates = (demodulation[name] for name in DemodulationResult._fields[:5])
+                results.update(zip(DEMODULATION_OUTPUTS[:5], intermediates))
+
+        remove_stale_outputs(output_folder, {os.path.join(output_folder, name) + writer.extension for name in results})
+        for name, img in results.items():
+            record["writes"].append(writer.submit(os.path.join(output_folder, name), img))
+        if metrics is not None:
+            record["metrics"] = metrics.to_dict()
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+# Processes a batch of files in one worker. Each file's outputs are written on the background I/O pool while the
+# next file is loaded and computed; the writes are awaited at the end and reported in the records
+def process_batch(paths, options):
+    records = []
+    with OutputWriter(options["format"], options["dtype"], options["compression"], options["io_workers"]) as writer:
+        for path in paths:
+            records.append(process_file(path, options, writer))
+
+    for record in records:
+        writes = record.pop("writes")
+        record["timings"]["write"] = 0.0
+        for future in writes:
+            try:
+                output_path, seconds = future.result()
+            except Exception as e:
+                record["status"] = "error"
+                record.setdefault("error", f"{type(e).__name__}: {e}")
+                continue
+            record["outputs"].append(output_path)
+            record["timings"]["write"] += seconds
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Headless batch processing of microscope TIF stacks (projections) and images (demodulation)"
+    )
+    parser.add_argument("inputs", nargs="*", help="Input files or glob patterns (.tif/.tiff stacks, .png/.jpg images)")
+    parser.add_argument("--manifest", help="File listing the inputs (one path per line, or a JSON list)")
+    parser.add_argument("--output", "-o", default="output_images/", help="Output folder (one subfolder per input, mirroring the input folders)")
+    parser.add_argument("--projections", nargs="+", choices=PROJECTIONS, default=list(PROJECTIONS))
+    parser.add_argument("--low-memory", action="store_true", help="Low-memory weighted complex average")
+    parser.add_argument("--precision", choices=("float64", "float32"), default="float64")
+    parser.add_argument("--demodulation", choices=("standard", "baseband"), default="standard")
+    parser.add_argument("--intermediates", action="store_true", help="Also save the demodulation intermediates")
+    parser.add_argument("--channels", type=int, nargs="+", metavar="C",
+                        help="Frames of the TIF stacks to process (default: all)")
+    parser.add_argument("--roi", type=int, nargs=4, metavar=("ROW_START", "ROW_STOP", "COL_START", "COL_STOP"),
+                        help="Region of interest to process (only its strips or tiles are read from TIFs)")
+    parser.add_argument("--period", "-T", type=float, default=16, help="Modulation period in pixels")
+    parser.add_argument("--order", type=int, default=8, help="Butterworth filter order")
+    parser.add_argument("--format", choices=tuple(OUTPUT_FORMATS), default="tiff", help="Output file format")
+    parser.add_argument("--dtype", choices=OUTPUT_DTYPES, default="float32", help="Output sample type")
+    parser.add_argument("--compression", choices=OUTPUT_COMPRESSIONS, default="none", help="Output compression")
+    parser.add_argument("--io-workers", type=int, default=2, help="Background writer threads per worker")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--max-memory", type=parse_size, help="Per-worker memory limit, e.g. 2G (enables streaming)")
+    parser.add_argument("--fft-backend", choices=("numpy", "scipy", "pyfftw"), default="numpy")
+    parser.add_argument("--fft-workers", type=int, help="FFT threads per worker (scipy/pyfftw backends)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Result cache folder. The first run on a file reads it once more to hash its "
+                             "content; the hash is kept in the cache folder and reused while the file size and "
+                             "modification time are unchanged")
+    parser.add_argument("--cache-size", type=parse_size, default=DEFAULT_CACHE_BYTES, help="Result cache size limit, e.g. 2G")
+    parser.add_argument("--no-cache", action="store_true", help="Always recompute, without reading or writing the cache")
+    parser.add_argument("--metrics", action="store_true",
+                        help="Record per-stage timings, peak memory and FFT counts in the summary")
+    parser.add_argument("--summary", default=None, help="JSON file for the per-file timings summary")
+    args = parser.parse_args(argv)
+
+    paths = collect_inputs(args.inputs or ([] if args.manifest else DEFAULT_INPUTS), args.manifest)
+    paths = [path for path in paths if path.lower().endswith(TIF_EXTENSIONS + IMAGE_EXTENSIONS)]
+    if not paths:
+        parser.error("no input files")
+    try:
+        folders = output_folders(paths, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = {
+        "folders": folders,
+        "projections": args.projections,
+        "low_memory": args.low_memory,
+        "precision": args.precision,
+        "demodulation": args.demodulation,
+        "intermediates": args.intermediates,
+        "channels": args.channels,
+        "roi": args.roi,
+        "period": args.period,
+        "order": args.order,
+        # Half of the per-worker limit is left to the interpreter, the loaded stack chunks and the outputs
+        "memory_budget": args.max_memory // 2 if args.max_memory else None,
+        "cache_dir": None if args.no_cache else args.cache_dir,
+        "cache_size": args.cache_size,
+        "format": args.format,
+        "dtype": args.dtype,
+        "compression": args.compression,
+        "io_workers": args.io_workers,
+        "metrics": args.metrics,
+    }
+
+    # ------------ Fan batches of files out across the process pool
+    start = time.perf_counter()
+    records = []
+    workers = max(1, min(args.workers or 1, len(paths)))
+    # A few batches per worker balance the load, each batch overlaps its computations with its writes
+    batch_size = max(1, -(-len(paths) // (workers * 4)))
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(args.max_memory, args.fft_backend, args.fft_workers),
+    ) as executor:
+        futures = [executor.submit(process_batch, batch, options) for batch in batches]
+        for future in as_completed(futures):
+            for record in future.result():
+                records.append(record)
+                detail = record.get("error", f"{len(record['outputs'])} outputs, {record['cache_hits']} cached")
+                print(f"[{record['status']}] {record['path']} ({record['seconds']:.2f} s): {detail}")
+
+    # ------------ Summary of per-file timings
+    records.sort(key=lambda record: record["path"])
+    summary = {
+        "files": len(records),
+        "failed": sum(record["status"] != "ok" for record in records),
+        "workers": workers,
+        "wall_seconds": time.perf_counter() - start,
+        "cpu_seconds": sum(record["seconds"] for record in records),
+        "cache_hits": sum(record["cache_hits"] for record in records),
+        "records": records,
+    }
+    print(f"Processed {summary['files']} files ({summary['failed']} failed) with {workers} workers "
+          f"in {summary['wall_seconds']:.2f} s")
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
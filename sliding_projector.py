@@ -0,0 +1,123 @@
+import numpy as np
+
+from microscope_processor import MicroscopeProcessor, PROJECTIONS, ProjectionResult
+
+
+class SlidingWindowProjector:
+    """Frame combination projections over the last `window` frames of a live acquisition stream.
+
+    Frames are pushed one at a time and every update costs O(H·W) (amortized):
+    - average: running sum, the new frame is added and the evicted one subtracted
+    - weighted complex average: rotating complex accumulator A = Σ_t I_t exp(i·2π·t/C) over absolute frame
+      indices t. Its magnitude equals the weighted complex average of the window whatever the window start,
+      and the evicted frame has the same weight as the new one, so an update is A += (I_new - I_old)·w_t
+    - max-min: van Herk/Gil-Werman block algorithm. The stream is cut into blocks of C frames; the window
+      max/min is the max/min of the suffix of the previous block and the prefix of the current one. Suffixes
+      are computed once per block (O(C·H·W) every C frames)
+
+    Once per block, when the ring buffer holds the window in time order, the sum and the accumulator are
+    recomputed exactly, so float inputs do not drift and results match MicroscopeProcessor on the window.
+    Until the window is full the projections cover the frames received so far (the weighted complex average
+    still uses the window length C in its weights).
+    """
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError(f"Window must hold at least one frame, got {window}")
+        self.window = window
+        self.count = 0
+        self._ring = None
+        self._weights = MicroscopeProcessor._weighted_complex_weights(window)
+
+    @property
+    def is_full(self):
+        return self.count >= self.window
+
+    def _allocate(self, frame):
+        C = self.window
+        shape = frame.shape
+        self._ring = np.empty((C,) + shape, dtype=frame.dtype)
+        self._sum = np.zeros(shape, dtype=np.sum(np.zeros((1, 1), dtype=frame.dtype), axis=0).dtype)
+        self._complex = np.zeros(shape, dtype=np.complex128)
+        self._prefix_max = np.empty(shape, dtype=frame.dtype)
+        self._prefix_min = np.empty(shape, dtype=frame.dtype)
+        self._suffix_max = np.empty((C,) + shape, dtype=frame.dtype)
+        self._suffix_min = np.empty((C,) + shape, dtype=frame.dtype)
+
+    # Adds a (H, W) frame to the window, evicting the oldest one once the window is full
+    def push(self, frame):
+        frame = np.asarray(frame)
+        if self._ring is None:
+            self._allocate(frame)
+        elif frame.shape != self._ring.shape[1:]:
+            raise ValueError(f"Frame has shape {frame.shape}, expected {self._ring.shape[1:]}")
+
+        C = self.window
+        j = self.count % C
+        slot = self._ring[j]
+        if self.is_full:
+            # The evicted frame sits in the slot being overwritten and has the same weight w_j
+            self._sum -= slot
+            self._complex -= slot * self._weights[j]
+        slot[...] = frame
+        self._sum += slot
+        self._complex += slot * self._weights[j]
+
+        if j == 0:
+            self._prefix_max[...] = slot
+            self._prefix_min[...] = slot
+        else:
+            np.maximum(self._prefix_max, slot, out=self._prefix_max)
+            np.minimum(self._prefix_min, slot, out=self._prefix_min)
+
+        self.count += 1
+        if j == C - 1:
+            self._complete_block()
+
+    # The ring buffer holds a whole block in time order: suffix max/min for the next block, exact resync of the
+    # running sum and accumulator
+    def _complete_block(self):
+        C = self.window
+        self._suffix_max[C - 1] = self._ring[C - 1]
+        self._suffix_min[C - 1] = self._ring[C - 1]
+        for j in range(C - 2, -1, -1):
+            np.maximum(self._ring[j], self._suffix_max[j + 1], out=self._suffix_max[j])
+            np.minimum(self._ring[j], self._suffix_min[j + 1], out=self._suffix_min[j])
+        self._sum = np.sum(self._ring, axis=0)
+        self._complex = np.sum(self._ring * self._weights[:, None, None], axis=0)
+
+    def _check_frames(self):
+        if self.count == 0:
+            raise ValueError("No frame has been pushed yet")
+
+    # Frame combination algorithm. Average projection over the window (sum across the C frames)
+    def average_projection(self):
+        self._check_frames()
+        return self._sum.copy()
+
+    # Frame combination algorithm. Max-min projection over the window
+    def max_min_projection(self):
+        self._check_frames()
+        j = self.count % self.window
+        if self.count <= self.window or j == 0:
+            # The window is exactly the current block (or the frames received so far)
+            return self._prefix_max - self._prefix_min
+        window_max = np.maximum(self._suffix_max[j], self._prefix_max)
+        window_min = np.minimum(self._suffix_min[j], self._prefix_min)
+        return window_max - window_min
+
+    # Frame combination algorithm. Weighted complex average over the window
+    def weighted_complex_average(self):
+        self._check_frames()
+        return np.abs(self._complex)
+
+    def compute_projections(self, projections=PROJECTIONS):
+        methods = {
+            "average": self.average_projection,
+            "max_min": self.max_min_projection,
+            "weighted_complex": self.weighted_complex_average,
+        }
+        unknown = [name for name in projections if name not in PROJECTIONS]
+        if unknown:
+            raise ValueError(f"Unknown projection(s) {unknown}, expected any of {PROJECTIONS}")
+        return ProjectionResult(**{name: methods[name]() for name in projections})
@@ -0,0 +1,19 @@
+import numpy as np
+from matplotlib import pyplot as plt
+
+# Plotting helpers of MicroscopeProcessor, kept out of microscope_processor so the compute core imports without
+# matplotlib (it is imported on the first plot)
+
+
+# Log-magnitude of the centered 2-D spectrum of img, normalized to [0, 1] and drawn on the current pyplot axes
+def plot_spectrum(img, title, cmap='magma', fft_backend=None):
+    if fft_backend is None:
+        from microscope_processor import MicroscopeProcessor
+        fft_backend = MicroscopeProcessor.fft_backend
+    F = fft_backend.fft2(img)
+    F_shifted = fft_backend.fftshift(F)
+    magnitude = np.log1p(np.abs(F_shifted))
+    magnitude = magnitude / np.max(magnitude)
+    plt.imshow(magnitude, cmap=cmap)  # change colormap here
+    plt.title(title)
+    plt.axis('off')
@@ -0,0 +1,24 @@
+from microscope_processor import MicroscopeProcessor
+
+# Command-line and worker-process helpers shared by run_processing.py and processing_service.py, kept apart from
+# run_processing so the service does not import the batch outputs (output_writer, tifffile, result_cache)
+
+
+# Parses a size such as "512M" or "2G" into bytes
+def parse_size(text):
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# Process pool initializer: per-worker address-space limit and FFT backend
+def init_worker(max_memory, fft_backend, fft_workers):
+    if max_memory:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+        except (ImportError, ValueError, OSError):
+            pass
+    MicroscopeProcessor.set_fft_backend(fft_backend, fft_workers)